@@ -0,0 +1,245 @@
+## This file contains the benchmark harness for the input pipeline, the training step
+#  and batched inference of the models, run offline on synthetic data shaped like MNIST or CIFAR10
+#  Results are printed and written as JSON so that they can be compared between versions
+#
+
+# for user-friendly usage from the command line
+import argparse
+import textwrap
+
+# for timing and reporting
+import json
+import platform
+import resource
+import sys
+import time
+
+# importing the models
+from models import FullyConNN, ConvNN
+
+# importing the dataloaders
+from dataloaders import Synthetic
+
+import numpy as np
+import tensorflow as tf
+
+
+# shapes of the (flattened for the fully connected network) images of the datasets the synthetic data imitates
+SHAPES = {"mnist": (28 * 28,), "cifar10": (32, 32, 3)}
+
+
+
+
+## Summarizes latencies in seconds
+#  @latencies: list of float, latencies of single calls in seconds
+#  @samples: int, number of samples processed per call
+#  @return dict with latency percentiles in milliseconds and throughput
+#
+def summarize(latencies, samples):
+    latencies = np.asarray(latencies)
+    return {"calls": int(latencies.size),
+            "p50_ms": float(np.percentile(latencies, 50) * 1e3),
+            "p90_ms": float(np.percentile(latencies, 90) * 1e3),
+            "p99_ms": float(np.percentile(latencies, 99) * 1e3),
+            "mean_ms": float(latencies.mean() * 1e3),
+            "calls_per_sec": float(latencies.size / latencies.sum()),
+            "samples_per_sec": float(latencies.size * samples / latencies.sum())}
+
+
+## Peak resident set size of the process so far, in megabytes
+#  @return float
+#
+def peak_rss_mb():
+
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 ** 2 if sys.platform == "darwin" else rss / 1024
+
+
+## Measures the time to first batch and the latency of every following batch of a tf data loader object
+#  @tr_data: tf data loader object
+#  @batches: int, number of batches to time after the first one
+#  @batch_size: int, number of images in one batch
+#  @return dict
+#
+def bench_pipeline(tr_data, batches, batch_size):
+
+    start = time.perf_counter()
+    iterator = iter(tr_data.repeat())
+    next(iterator)
+    first = time.perf_counter() - start
+
+    latencies = []
+    for _ in range(batches):
+        start = time.perf_counter()
+        next(iterator)
+        latencies.append(time.perf_counter() - start)
+
+    return dict(summarize(latencies, batch_size), time_to_first_batch_ms = first * 1e3, peak_rss_mb = peak_rss_mb())
+
+
+## Measures the latency of training steps, the first warmup steps (including tracing) are reported separately
+#  @model: NeuralNetwork
+#  @optimizer: optimizer object from keras
+#  @tr_data: tf data loader object
+#  @steps, @warmup: int, number of timed and warmup steps
+#  @batch_size: int, number of images in one batch
+#  @return dict
+#
+def bench_train(model, optimizer, tr_data, steps, warmup, batch_size):
+
+    # batches are prepared up front so that only the step itself is timed
+    batches = list(tr_data.repeat().take(min(steps, 64)))
+
+    start = time.perf_counter()
+    for i in range(warmup):
+        model.train(batches[i % len(batches)], optimizer).numpy()
+    warmup_time = time.perf_counter() - start
+
+    # .numpy() waits for the step to finish
+    latencies = []
+    for i in range(steps):
+        start = time.perf_counter()
+        model.train(batches[i % len(batches)], optimizer).numpy()
+        latencies.append(time.perf_counter() - start)
+
+    return dict(summarize(latencies, batch_size), warmup_ms = warmup_time * 1e3, peak_rss_mb = peak_rss_mb())
+
+
+## Measures the latency of batched inference with test()
+#  @model: NeuralNetwork
+#  @x: array, images of the test subset
+#  @calls: int, number of timed calls
+#  @batch_size: int, number of images in one batch
+#  @return dict
+#
+def bench_inference(model, x, calls, batch_size):
+
+    batch = tf.constant(x[:batch_size])
+    model.test(batch).numpy()
+
+    latencies = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        model.test(batch).numpy()
+        latencies.append(time.perf_counter() - start)
+
+    return dict(summarize(latencies, batch.shape[0]), peak_rss_mb = peak_rss_mb())
+
+
+## Measures the latency of the batch augmentation on its own
+#  @data_loader: DataLoader
+#  @x, @y: array, a batch of scaled images and their labels
+#  @calls: int, number of timed calls
+#  @return dict
+#
+def bench_augment(data_loader, x, y, calls):
+
+    x, y = tf.constant(x), tf.constant(y)
+    augment = tf.function(data_loader.augment)
+    seeds = tf.random.Generator.from_seed(0)
+    augment(x, y, seeds.make_seeds(1)[:, 0])[0].numpy()
+
+    latencies = []
+    for _ in range(calls):
+        seed = seeds.make_seeds(1)[:, 0]
+        start = time.perf_counter()
+        augment(x, y, seed)[0].numpy()
+        latencies.append(time.perf_counter() - start)
+
+    return dict(summarize(latencies, x.shape[0]), peak_rss_mb = peak_rss_mb())
+
+
+## Runs all benchmarks for one configuration
+#  @args: argparse.Namespace, the parsed command line arguments
+#  @return dict with the configuration and the results of every benchmark
+#
+def run(args):
+
+    tf.keras.mixed_precision.set_global_policy(args.precision)
+
+    start = time.perf_counter()
+    data_loader = Synthetic(n_tr = args.n, shape = SHAPES[args.dset], lazy = args.lazy, sparse = args.sparse)
+    construct = time.perf_counter() - start
+
+    tr_data = data_loader.loader(batch_size = args.batch_size, tuned = (args.pipeline == "tuned"),
+                                 shuffle = args.shuffle, drop_remainder = True, augment = args.augment, seed = 0)
+
+    optimizer = tf.keras.optimizers.Adam(learning_rate = 5e-4)
+    if args.precision == "mixed_float16":
+        optimizer = tf.keras.mixed_precision.LossScaleOptimizer(optimizer)
+
+    if args.nn_type == "fully_con":
+        model = FullyConNN(neurons = args.neurons, y_dim = 10, sparse = args.sparse, fused = args.fused, logits = args.logits)
+    else:
+        model = ConvNN(neurons = args.neurons, y_dim = 10, sparse = args.sparse, fused = args.fused, logits = args.logits,
+                       separable = args.separable)
+
+    if not args.eager:
+        model.compile_train(optimizer, jit_compile = args.jit_compile, batch_size = args.batch_size)
+
+    results = {"config": vars(args),
+               "environment": {"tensorflow": tf.__version__, "python": platform.python_version(), "machine": platform.machine()},
+               "construct_ms": construct * 1e3,
+               "cost": model.cost()}
+    results["pipeline"] = bench_pipeline(tr_data, args.steps, args.batch_size)
+    results["train_step"] = bench_train(model, optimizer, tr_data, args.steps, args.warmup, args.batch_size)
+
+    # the augmentation overhead is reported relative to the median training step
+    if args.augment:
+        x, y = data_loader.take(np.arange(args.batch_size))
+        results["augment"] = bench_augment(data_loader, data_loader.scale(x), y, args.steps)
+        results["augment"]["pct_of_train_step"] = 100 * results["augment"]["p50_ms"] / results["train_step"]["p50_ms"]
+
+    x_te, _ = data_loader.take(np.arange(min(args.eval_batch_size, data_loader.n_te)), subset = "te")
+    results["inference"] = bench_inference(model, data_loader.scale(x_te), args.steps, args.eval_batch_size)
+
+    return results
+
+
+
+
+if __name__ == "__main__":
+
+    # define parser
+    parser = argparse.ArgumentParser(description =
+                                     textwrap.dedent("""Benchmarks the input pipeline, the training step and batched inference on synthetic data."""),
+                                     epilog =
+                                     textwrap.dedent("""This code may be run by using the following commands:
+    python3 benchmark.py --dset mnist --nn_type fully_con --output mnist.json
+    python3 benchmark.py --dset cifar10 --nn_type conv --jit_compile
+    python3 benchmark.py --dset cifar10 --nn_type conv --output conv.json
+    python3 benchmark.py --dset cifar10 --nn_type conv --separable --output separable.json"""),
+                                     formatter_class = argparse.RawTextHelpFormatter)
+
+    parser.add_argument("--dset", choices = ["mnist", "cifar10"], default = "mnist", help = "Dataset the synthetic data imitates")
+    parser.add_argument("--nn_type", choices = ["fully_con", "conv"], default = None, help = "Neural network architecture, by default the one matching the dataset")
+    parser.add_argument("--n", default = 60000, type = int, help = "Number of synthetic training images")
+    parser.add_argument("--neurons", default = 50, type = int, help = "Number of neurons to be used")
+    parser.add_argument("--batch_size", default = 256, type = int, help = "Number of images per training batch")
+    parser.add_argument("--eval_batch_size", default = 1024, type = int, help = "Number of images per inference batch")
+    parser.add_argument("--steps", default = 200, type = int, help = "Number of timed batches, steps and inference calls")
+    parser.add_argument("--warmup", default = 10, type = int, help = "Number of untimed training steps, including tracing")
+    parser.add_argument("--pipeline", choices = ["basic", "tuned"], default = "tuned", help = "Input pipeline")
+    parser.add_argument("--shuffle", choices = ["full", "index", "buffer"], default = "index", help = "Shuffling strategy of the input pipeline")
+    parser.add_argument("--augment", action = "store_true", help = "Augment training batches, only for --dset cifar10")
+    parser.add_argument("--lazy", action = "store_true", help = "Scale images per batch instead of up front")
+    parser.add_argument("--sparse", action = "store_true", help = "Keep labels as class indices")
+    parser.add_argument("--fused", action = "store_true", help = "Apply all layers as a single model with a loss on the logits")
+    parser.add_argument("--separable", action = "store_true", help = "Use depthwise-separable convolutions and pooling, only for --nn_type conv")
+    parser.add_argument("--logits", action = "store_true", help = "Compute the loss on logits and apply the softmax only for predictions")
+    parser.add_argument("--eager", action = "store_true", help = "Run the training step eagerly")
+    parser.add_argument("--jit_compile", action = "store_true", help = "Compile the training step with XLA")
+    parser.add_argument("--precision", choices = ["float32", "mixed_bfloat16", "mixed_float16"], default = "float32", help = "Keras dtype policy")
+    parser.add_argument("--output", default = None, help = "Path of the JSON file the results are written to")
+
+    args = parser.parse_args()
+    if args.nn_type is None:
+        args.nn_type = "fully_con" if args.dset == "mnist" else "conv"
+
+    results = run(args)
+    print(json.dumps(results, indent = 2))
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent = 2)
@@ -9,6 +9,21 @@ from keras.datasets import cifar10
 
 # for transformations
 import tensorflow as tf
+import numpy as np
+
+# for the on-disk cache of preprocessed arrays
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+# for sharing the preprocessed arrays between processes
+from multiprocessing import shared_memory
+
+
+# bumped whenever preprocess() changes in a way that makes cached arrays stale
+CACHE_VERSION = 1
 
 
 
@@ -24,18 +39,86 @@ class DataLoader:
         x_tr: array, features from training subset
         y_te: array, labels from test subset
         y_tr: array, labels from training subset
+        n_te: int, number of observations in test subset
+        n_tr: int, number of observations in training subset
+        n_va: int, number of observations in validation subset, 0 until split_validation() is called
+        sparse: bool, whether labels are class indices
+
+        While calling the constructor method the following parameters are expected:
+            @lazy: bool, if True images are kept as uint8 and scaled per batch by loader() and scale(), by default False
+            @cache_dir: str or None, directory where subclasses store preprocessed arrays and from which 
+                        they reopen them memory-mapped on the next construction, by default None (no cache)
+            @sparse: bool, if True labels are kept as int32 class indices instead of being one-hot encoded, by default False
 
     Public methods:
 
         preprocess()
             Applies preprocessing trasformations on dataset.
-            Image scaling and one-hot-encoding of labels.
+            Image scaling (unless scaling is lazy) and one-hot-encoding of labels (unless labels are sparse).
 
-        loader(batch_size)
+        scale(x)
+            Scales images to be between 0 and 1 if scaling is lazy, otherwise returns them unchanged
+            @x: array or tensor, images from either subset
+            @return images as float32 
+
+        loader(batch_size, tuned = False, cache = False, deterministic = True, drop_remainder = False, shuffle = "full", buffer_size = None,
+               augment = False, seed = None, skip = 0)
             Enables a user to load dataset in batches 
             @batch_size: int, number of images in one batch
+            @tuned: bool, batches in parallel and prefetches batches so that input preparation overlaps with training
+            @cache: bool, caches the dataset after the first epoch, only used by the tuned pipeline with "full" or "buffer" shuffling
+            @deterministic: bool, if False the tuned pipeline may produce batches out of order for higher throughput
+            @drop_remainder: bool, drops the last incomplete batch so that all batches have the same shape
+            @shuffle: str, "full" shuffles copies of all images in a buffer of the size of the training subset, 
+                           "index" shuffles only a vector of indices and gathers batches from the stored arrays,
+                           "buffer" reads the arrays in order and shuffles them in a buffer of buffer_size images
+            @buffer_size: int, the size of the shuffle buffer for "buffer" shuffling, by default 16 batches
+            @augment: bool, applies random crops (after reflection padding by 4 pixels), horizontal flips and 
+                            brightness changes to whole batches of images, only for images of shape (height, width, channels)
+            @seed: int or None, seed of the shuffling and the augmentation, None draws a nondeterministic seed
+            @skip: int, number of batches skipped at the beginning of every iteration, together with the seed
+                        this resumes an interrupted epoch, "index" shuffling skips without gathering the images
             @return tf data loader object
 
+        augment(x, y, seed, pad = 4, max_delta = 0.1)
+            Augments a batch of scaled images with random crops, horizontal flips and brightness changes,
+            used by loader() if augment is True
+            @x: tensor, batch of scaled images of shape (batch, height, width, channels)
+            @y: tensor, batch of labels, returned unchanged
+            @seed: tensor of shape (2,), seed of the random ops
+            @pad: int, images are padded by pad pixels on every side before cropping
+            @max_delta: float, maximum brightness change
+            @return a tuple (x, y) with the augmented images and the labels
+
+        test_loader(batch_size, subset = "te")
+            Enables a user to load the test subset in batches of consecutive images, for evaluation
+            @batch_size: int, number of images in one batch
+            @subset: str, "te" for the test subset or "va" for the validation subset
+            @return tf data loader object
+
+        split_validation(fraction)
+            Moves the last observations of the training subset into a validation subset, 
+            the arrays are split into views, nothing is copied
+            @fraction: float, share of the training subset used for validation, between 0 and 1
+
+        take(idx, subset = "tr")
+            Gathers observations with the provided indices from a subset, without materializing the subset
+            @idx: array of int, indices of the observations
+            @subset: str, "tr" for the training subset, "va" for the validation subset and "te" for the test subset
+            @return a tuple (x, y) with the features and labels of the observations
+
+        to_shards(directory, records_per_shard = 8192)
+            Writes the preprocessed dataset to fixed-size record shards and an index file, 
+            which can be streamed with the Sharded dataloader
+            @directory: str, directory the shards and index.json are written to
+            @records_per_shard: int, number of observations per shard
+
+        to_shared_memory()
+            Copies the preprocessed dataset into shared memory blocks, which other processes 
+            can attach to without copying with the Shared dataloader
+            @return a tuple (spec, blocks) with a picklable description of the blocks for Shared
+                    and the SharedMemory objects, which the caller closes and unlinks once all processes are done
+
     Examples of usage:
         
         # creates an instance of DataLoader class
@@ -44,37 +127,100 @@ class DataLoader:
     """
 
     ## Constructs an object 
+    #  @lazy: bool, if True images are kept as uint8 and scaled per batch, by default False
+    #  @cache_dir: str or None, directory of the cache of preprocessed arrays, by default None
+    #  @sparse: bool, if True labels are kept as int32 class indices, by default False
     #
-    def __init__(self):
-        pass
+    def __init__(self, lazy = False, cache_dir = None, sparse = False):
+        self._lazy = lazy
+        self._cache_dir = cache_dir
+        self._sparse = sparse
+        self._n_va = 0
 
 
-    ## Accessor for _x_tr
+    ## Accessor for the training features, see _arrays()
     #
     @property
     def x_tr(self):
-        return self._x_tr
+        return self._arrays("tr")[0]
 
 
-    ## Accessor for _x_te
+    ## Accessor for the test features, see _arrays()
     #
     @property
     def x_te(self):
-        return self._x_te
+        return self._arrays("te")[0]
 
 
-    ## Accessor for _y_tr
+    ## Accessor for the training labels, see _arrays()
     #
     @property
     def y_tr(self):
-        return self._y_tr
+        return self._arrays("tr")[1]
     
 
-    ## Accessor for _y_te
+    ## Accessor for the test labels, see _arrays()
     #
     @property
     def y_te(self):
-        return self._y_te
+        return self._arrays("te")[1]
+
+
+    ## Accessor for _sparse
+    #
+    @property
+    def sparse(self):
+        return self._sparse
+
+
+    ## Number of observations in the training subset
+    #
+    @property
+    def n_tr(self):
+        return self._size("tr")
+
+
+    ## Number of observations in the test subset
+    #
+    @property
+    def n_te(self):
+        return self._size("te")
+
+
+    ## Number of observations in the validation subset
+    #
+    @property
+    def n_va(self):
+        return self._n_va
+
+
+    ## Moves the last observations of the training subset into a validation subset
+    #  The training subset shrinks accordingly, so training never sees the validation images
+    #  @fraction: float, share of the training subset used for validation, between 0 and 1
+    #
+    def split_validation(self, fraction):
+
+        if self._n_va > 0:
+            raise ValueError("the validation subset has already been split off")
+        if not 0 < fraction < 1:
+            raise ValueError("fraction should be between 0 and 1")
+
+        n_va = int(round(fraction * self._size("tr")))
+        if not 0 < n_va < self._size("tr"):
+            raise ValueError("fraction leaves either the training or the validation subset empty")
+
+        self._split(n_va)
+        self._n_va = n_va
+
+
+    ## Splits the stored arrays into views of the training and the validation subset
+    #  @n_va: int, number of observations in the validation subset
+    #
+    def _split(self, n_va):
+        x, y = self._arrays("tr")
+        n = x.shape[0] - n_va
+        self._x_tr, self._x_va = x[:n], x[n:]
+        self._y_tr, self._y_va = y[:n], y[n:]
 
 
     ## Applies preprocessing trasformations on dataset
@@ -83,23 +229,403 @@ class DataLoader:
         
         # scales features (image represenations) to be between 0 and 1
         # and ensures that features in both subsets are are number float32
-        self._x_tr = (self._x_tr / 255).astype(dtype = "float32")
-        self._x_te = (self._x_te / 255).astype(dtype = "float32")
+        # lazy scaling keeps the uint8 images, which are 4 times smaller, and scales them per batch instead
+        if not self._lazy:
+            self._x_tr = (self._x_tr / 255).astype(dtype = "float32")
+            self._x_te = (self._x_te / 255).astype(dtype = "float32")
         
+        # sparse labels stay class indices, flattened since CIFAR10 labels have shape (n, 1)
+        if self._sparse:
+            self._y_tr = self._y_tr.reshape(-1).astype(dtype = "int32")
+            self._y_te = self._y_te.reshape(-1).astype(dtype = "int32")
+
         # Applies one-hot-encoding to labels in both subsets
-        self._y_tr = tf.keras.utils.to_categorical(self._y_tr)
-        self._y_te = tf.keras.utils.to_categorical(self._y_te)
+        else:
+            self._y_tr = tf.keras.utils.to_categorical(self._y_tr)
+            self._y_te = tf.keras.utils.to_categorical(self._y_te)
 
 
     ## Enables a user to load dataset in batches 
     #  @batch_size: int, number of images in one batch
+    #  @tuned: bool, batches in parallel and prefetches batches so that input preparation overlaps with training
+    #  @cache: bool, caches the dataset after the first epoch, only used by the tuned pipeline with "full" or "buffer" shuffling
+    #  @deterministic: bool, if False the tuned pipeline may produce batches out of order for higher throughput
+    #  @drop_remainder: bool, drops the last incomplete batch so that all batches have the same shape
+    #  @shuffle: str, one of "full", "index" or "buffer", see the class documentation
+    #  @buffer_size: int, the size of the shuffle buffer for "buffer" shuffling, by default 16 batches
+    #  @augment: bool, applies random crops, horizontal flips and brightness changes to whole batches of images
+    #  @seed: int or None, seed of the shuffling and the augmentation, None draws a nondeterministic seed
+    #  @skip: int, number of batches skipped at the beginning of every iteration
     #  @return tf data loader object
     # 
-    def loader(self, batch_size):
-        tf_dl = tf.data.Dataset.from_tensor_slices((self._x_tr, self._y_tr)).shuffle(self._x_tr.shape[0]).batch(batch_size)
+    def loader(self, batch_size, tuned = False, cache = False, deterministic = True, drop_remainder = False, 
+               shuffle = "full", buffer_size = None, augment = False, seed = None, skip = 0):
+
+        if shuffle not in ("full", "index", "buffer"):
+            raise ValueError("shuffle should be one of 'full', 'index' or 'buffer'")
+
+        # parallelism is only used by the tuned pipeline, deterministic only affects parallel stages 
+        # and is left out of the basic pipeline, where tf.data warns that it has no effect
+        parallel = {"num_parallel_calls": tf.data.AUTOTUNE, "deterministic": deterministic} if tuned else {}
+        
+        # shuffles a vector of indices (an int64 per image instead of a copy of the image) 
+        # and gathers the images of each batch from the stored arrays
+        if shuffle == "index":
+            n = self._size("tr")
+            tf_dl = tf.data.Dataset.range(n).shuffle(n, seed = seed).batch(batch_size, drop_remainder = drop_remainder)
+
+            # skipping batches of indices is cheap, no images are gathered for them
+            tf_dl = tf_dl.skip(skip)
+            tf_dl = tf_dl.map(self._gather, **parallel)
+
+        else:
+            
+            # "buffer" reads the stored arrays in order, in chunks of one batch, 
+            # and only keeps buffer_size images in the shuffle buffer
+            if shuffle == "buffer":
+                n = self._size("tr")
+                buffer_size = 16 * batch_size if buffer_size is None else buffer_size
+                tf_dl = tf.data.Dataset.range(n).batch(batch_size)
+                tf_dl = tf_dl.map(self._gather, **parallel).unbatch()
+            
+            # "full" copies the arrays into the dataset and shuffles them in a buffer of the size of the training subset
+            else:
+                buffer_size = self._size("tr")
+                tf_dl = tf.data.Dataset.from_tensor_slices(self._arrays("tr"))
+
+            # caching happens before shuffling, so that every epoch is still shuffled differently
+            if tuned and cache:
+                tf_dl = tf_dl.cache()
+
+            # batches are assembled in parallel by the tuned pipeline
+            tf_dl = tf_dl.shuffle(buffer_size, seed = seed)
+            tf_dl = tf_dl.batch(batch_size, drop_remainder = drop_remainder, 
+                                **parallel)
+            tf_dl = tf_dl.skip(skip)
+
+        return self._finish(tf_dl, tuned = tuned, deterministic = deterministic, augment = augment, seed = seed, skip = skip)
+
+
+    ## Applies the stages that follow batching, shared by all pipelines
+    #  @tf_dl: tf data loader object that yields batches
+    #  @tuned: bool, whether the tuned pipeline is used
+    #  @deterministic: bool, whether batches have to be produced in order
+    #  @augment: bool, whether batches are augmented
+    #  @seed: int or None, seed of the augmentation
+    #  @skip: int, number of batches that were skipped before the first batch
+    #  @return tf data loader object
+    #
+    def _finish(self, tf_dl, tuned, deterministic, augment = False, seed = None, skip = 0):
+
+        # parallelism is only used by the tuned pipeline, deterministic only affects parallel stages 
+        # and is left out of the basic pipeline, where tf.data warns that it has no effect
+        parallel = {"num_parallel_calls": tf.data.AUTOTUNE, "deterministic": deterministic} if tuned else {}
+
+        # with lazy scaling the uint8 images are scaled one batch at a time
+        if self._lazy:
+            tf_dl = tf_dl.map(lambda x, y: (self.scale(x), y), **parallel)
+
+        if augment:
+
+            if len(self._spec("tr")[1]) != 3:
+                raise ValueError("augmentation needs images of shape (height, width, channels)")
+
+            # a seed pair per batch is drawn sequentially, so that the augmentation is reproducible 
+            # even though the batches themselves are augmented in parallel, the generator keeps 
+            # advancing across epochs, so every epoch is augmented differently
+            # every pipeline has its own generator, which is kept alive by the returned dataset
+            if seed is None:
+                rng = tf.random.Generator.from_non_deterministic_state()
+            else:
+                rng = tf.random.Generator.from_seed(seed)
+
+            # the seeds of the skipped batches are drawn as well, so that a resumed epoch 
+            # is augmented exactly as the interrupted one
+            for _ in range(skip):
+                rng.make_seeds(1)
+
+            tf_dl = tf_dl.map(lambda x, y: (x, y, rng.make_seeds(1)[:, 0]))
+            tf_dl = tf_dl.map(self.augment, **parallel)
+
+        # the basic pipeline stops here
+        if tuned:
+        
+            # batches are prefetched while the model trains on the previous ones
+            tf_dl = tf_dl.prefetch(tf.data.AUTOTUNE)
+
+            # lets tf.data reorder elements across the whole pipeline if determinism is not required
+            options = tf.data.Options()
+            options.deterministic = deterministic
+            tf_dl = tf_dl.with_options(options)
+
+        if augment:
+            tf_dl.augment_rng = rng
+
         return tf_dl
 
 
+    ## Scales images to be between 0 and 1 if scaling is lazy, otherwise returns them unchanged
+    #  @x: array or tensor, images from either subset
+    #  @return images as float32 
+    #
+    def scale(self, x):
+        
+        # images were already scaled by preprocess()
+        if not self._lazy:
+            return x
+
+        return tf.cast(x, tf.float32) / 255
+
+
+    ## Parameters the preprocessed arrays depend on, 
+    #  the cache entry is keyed on them so that changing any of them invalidates it
+    #  @return dict
+    #
+    def _cache_params(self):
+        return {"dataset": type(self).__name__.lower(), "lazy": self._lazy, "sparse": self._sparse, "version": CACHE_VERSION}
+
+
+    ## Path of the cache entry for the current parameters
+    #  @return str
+    #
+    def _cache_path(self):
+        params = self._cache_params()
+        digest = hashlib.sha1(json.dumps(params, sort_keys = True).encode()).hexdigest()[:16]
+        return os.path.join(self._cache_dir, f"{params['dataset']}-{digest}")
+
+
+    ## Reopens preprocessed arrays from the cache as read-only memory maps
+    #  @return bool, True if the cache had a valid entry for the current parameters
+    #
+    def _read_cache(self):
+
+        if self._cache_dir is None:
+            return False
+
+        path = self._cache_path()
+
+        # the stored parameters guard against stale entries, e.g. after a hash collision
+        try:
+            with open(os.path.join(path, "params.json")) as f:
+                if json.load(f) != self._cache_params():
+                    return False
+
+            self._x_tr = np.load(os.path.join(path, "x_tr.npy"), mmap_mode = "r")
+            self._x_te = np.load(os.path.join(path, "x_te.npy"), mmap_mode = "r")
+            self._y_tr = np.load(os.path.join(path, "y_tr.npy"), mmap_mode = "r")
+            self._y_te = np.load(os.path.join(path, "y_te.npy"), mmap_mode = "r")
+
+        except (OSError, ValueError):
+            return False
+
+        return True
+
+
+    ## Writes the preprocessed arrays to the cache
+    #  The entry is written to a temporary directory first and renamed afterwards,
+    #  so that concurrent runs never see a partially written entry
+    #
+    def _write_cache(self):
+
+        if self._cache_dir is None:
+            return
+        
+        os.makedirs(self._cache_dir, exist_ok = True)
+        path = self._cache_path()
+        tmp = tempfile.mkdtemp(dir = self._cache_dir)
+
+        np.save(os.path.join(tmp, "x_tr.npy"), self._x_tr)
+        np.save(os.path.join(tmp, "x_te.npy"), self._x_te)
+        np.save(os.path.join(tmp, "y_tr.npy"), self._y_tr)
+        np.save(os.path.join(tmp, "y_te.npy"), self._y_te)
+
+        # the parameters are written last, an entry without them is never read
+        with open(os.path.join(tmp, "params.json"), "w") as f:
+            json.dump(self._cache_params(), f)
+
+        # removes a stale entry, which _read_cache() has rejected, and moves the new one in place
+        shutil.rmtree(path, ignore_errors = True)
+        try:
+            os.rename(tmp, path)
+
+        # another run has moved its entry in place in the meantime
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors = True)
+
+
+    ## Augments a batch of scaled images with random crops, horizontal flips and brightness changes
+    #  Every image gets its own crop, flip and brightness change, computed with vectorized stateless ops
+    #  @x: tensor, batch of scaled images of shape (batch, height, width, channels)
+    #  @y: tensor, batch of labels, returned unchanged
+    #  @seed: tensor of shape (2,), seed of the random ops
+    #  @pad: int, images are padded by pad pixels on every side before cropping, by default 4
+    #  @max_delta: float, maximum brightness change, by default 0.1
+    #  @return a tuple (x, y) with the augmented images and the labels
+    #
+    def augment(self, x, y, seed, pad = 4, max_delta = 0.1):
+
+        crop_seed, flip_seed, brightness_seed = tf.unstack(tf.random.experimental.stateless_split(seed, num = 3))
+        n, height, width = tf.shape(x)[0], x.shape[1], x.shape[2]
+
+        # random crops of the original size from the padded images, crop_and_resize with boxes 
+        # on whole pixels samples exactly those pixels, so no interpolation takes place
+        padded = tf.pad(x, [[0, 0], [pad, pad], [pad, pad], [0, 0]], mode = "REFLECT")
+        offsets = tf.cast(tf.random.stateless_uniform([n, 2], seed = crop_seed, minval = 0, maxval = 2 * pad + 1, dtype = tf.int32), tf.float32)
+        boxes = tf.stack([offsets[:, 0] / (height + 2 * pad - 1), offsets[:, 1] / (width + 2 * pad - 1), 
+                          (offsets[:, 0] + height - 1) / (height + 2 * pad - 1), (offsets[:, 1] + width - 1) / (width + 2 * pad - 1)], axis = 1)
+        x = tf.image.crop_and_resize(padded, boxes, tf.range(n), [height, width])
+
+        # flips half of the images horizontally
+        flip = tf.random.stateless_uniform([n, 1, 1, 1], seed = flip_seed) < 0.5
+        x = tf.where(flip, tf.reverse(x, axis = [2]), x)
+
+        # changes the brightness of every image by its own delta
+        delta = tf.random.stateless_uniform([n, 1, 1, 1], seed = brightness_seed, minval = -max_delta, maxval = max_delta)
+        x = tf.clip_by_value(x + delta, 0, 1)
+
+        return x, y
+
+
+    ## Enables a user to load the test subset in batches of consecutive images, for evaluation
+    #  Batches are gathered from the stored arrays one at a time, so memory does not grow with the test subset
+    #  @batch_size: int, number of images in one batch
+    #  @subset: str, "te" for the test subset or "va" for the validation subset
+    #  @return tf data loader object
+    #
+    def test_loader(self, batch_size, subset = "te"):
+
+        tf_dl = tf.data.Dataset.range(self._size(subset)).batch(batch_size)
+        tf_dl = tf_dl.map(lambda idx: self._gather(idx, subset = subset), num_parallel_calls = tf.data.AUTOTUNE)
+
+        return self._finish(tf_dl, tuned = True, deterministic = True)
+
+
+    ## Returns the stored arrays of a subset
+    #  @subset: str, "tr" for the training subset, "va" for the validation subset and "te" for the test subset
+    #  @return a tuple (x, y) with the features and labels of the subset
+    #
+    def _arrays(self, subset):
+        if subset == "te":
+            return self._x_te, self._y_te
+        if subset == "va":
+            return self._x_va, self._y_va
+        return self._x_tr, self._y_tr
+
+
+    ## Writes the preprocessed dataset to fixed-size record shards and an index file
+    #  Every record holds the bytes of one image followed by the bytes of its label, both little-endian,
+    #  the subsets are written chunk by chunk so that memory stays bounded
+    #  @directory: str, directory the shards and index.json are written to
+    #  @records_per_shard: int, number of observations per shard
+    #
+    def to_shards(self, directory, records_per_shard = 8192):
+
+        os.makedirs(directory, exist_ok = True)
+        x_dtype, x_shape, y_dtype, y_shape = self._spec("tr")
+        record = np.dtype([("x", np.dtype(x_dtype).newbyteorder("<"), tuple(x_shape)), 
+                           ("y", np.dtype(y_dtype).newbyteorder("<"), tuple(y_shape))])
+
+        index = {"x_dtype": np.dtype(x_dtype).name, "x_shape": list(x_shape),
+                 "y_dtype": np.dtype(y_dtype).name, "y_shape": list(y_shape),
+                 "record_bytes": record.itemsize, "lazy": self._lazy, "sparse": self._sparse, "subsets": {}}
+
+        for subset in self._subsets():
+            shards = []
+            n = self._size(subset)
+            for start in range(0, n, records_per_shard):
+                stop = min(start + records_per_shard, n)
+                records = np.empty(stop - start, dtype = record)
+                records["x"], records["y"] = self._take(np.arange(start, stop), subset)
+
+                name = f"{subset}-{len(shards):05d}.bin"
+                records.tofile(os.path.join(directory, name))
+                shards.append({"file": name, "records": stop - start})
+
+            index["subsets"][subset] = {"n": n, "shards": shards}
+
+        # the index is written last, a directory without it is incomplete
+        with open(os.path.join(directory, "index.json"), "w") as f:
+            json.dump(index, f, indent = 2)
+
+
+    ## Copies the preprocessed dataset into shared memory blocks, one block per array
+    #  @return a tuple (spec, blocks) with a picklable description of the blocks for Shared 
+    #          and the SharedMemory objects, which the caller closes and unlinks once all processes are done
+    #
+    def to_shared_memory(self):
+
+        spec = {"lazy": self._lazy, "sparse": self._sparse, "arrays": {}}
+        blocks = []
+        for subset in self._subsets():
+            for name, array in zip(("x", "y"), self._arrays(subset)):
+                block = shared_memory.SharedMemory(create = True, size = max(array.nbytes, 1))
+                np.ndarray(array.shape, dtype = array.dtype, buffer = block.buf)[...] = array
+                spec["arrays"][f"{name}_{subset}"] = {"name": block.name, "shape": list(array.shape), "dtype": array.dtype.name}
+                blocks.append(block)
+
+        return spec, blocks
+
+
+    ## Subsets of the dataset, the validation subset only once it has been split off
+    #  @return tuple of str
+    #
+    def _subsets(self):
+        return ("tr", "va", "te") if self._n_va > 0 else ("tr", "te")
+
+
+    ## Number of observations in a subset
+    #  @subset: str, "tr" for the training subset and "te" for the test subset
+    #  @return int
+    #
+    def _size(self, subset):
+        return self._arrays(subset)[0].shape[0]
+
+
+    ## Dtypes and shapes (without the first dimension) of the features and labels of a subset
+    #  @subset: str, "tr" for the training subset and "te" for the test subset
+    #  @return a tuple (x_dtype, x_shape, y_dtype, y_shape)
+    #
+    def _spec(self, subset):
+        x, y = self._arrays(subset)
+        return x.dtype, x.shape[1:], y.dtype, y.shape[1:]
+
+
+    ## Gathers observations with the provided indices from a subset
+    #  @idx: array of int, indices of the observations
+    #  @subset: str, "tr" for the training subset and "te" for the test subset
+    #  @return a tuple (x, y) with the features and labels of the observations
+    #
+    def _take(self, idx, subset = "tr"):
+        x, y = self._arrays(subset)
+        return np.take(x, idx, axis = 0), np.take(y, idx, axis = 0)
+
+
+    ## Gathers observations with the provided indices from a subset, subclasses only override _take()
+    #  @idx: array of int, indices of the observations
+    #  @subset: str, "tr" for the training subset, "va" for the validation subset and "te" for the test subset
+    #  @return a tuple (x, y) with the features and labels of the observations
+    #
+    def take(self, idx, subset = "tr"):
+        return self._take(idx, subset = subset)
+
+
+    ## Wraps _take() so that it can be used inside of tf.data pipelines
+    #  @idx: tensor of int64, indices of the observations
+    #  @subset: str, "tr" for the training subset and "te" for the test subset
+    #  @return a tuple (x, y) of tensors with the features and labels of the observations
+    #
+    def _gather(self, idx, subset = "tr"):
+
+        x_dtype, x_shape, y_dtype, y_shape = self._spec(subset)
+        x, y = tf.numpy_function(lambda i: self._take(i, subset), [idx], [tf.as_dtype(x_dtype), tf.as_dtype(y_dtype)])
+
+        # numpy_function loses the static shapes, they are restored from the stored arrays
+        x.set_shape(idx.shape.concatenate(x_shape))
+        y.set_shape(idx.shape.concatenate(y_shape))
+
+        return x, y
+
+
 
 
 class MNIST(DataLoader):
@@ -133,8 +659,18 @@ class MNIST(DataLoader):
 
     ## Constructs and object, loads MNIST data, asserts that the subsets are of correct shape
     #  and calls preprocess() method
+    #  @lazy: bool, if True images are kept as uint8 and scaled per batch, by default False
+    #  @cache_dir: str or None, directory of the cache of preprocessed arrays, by default None
+    #  @sparse: bool, if True labels are kept as int32 class indices, by default False
     #
-    def __init__(self):
+    def __init__(self, lazy = False, cache_dir = None, sparse = False):
+
+        # calls the constructor method of DataLoader class
+        super().__init__(lazy = lazy, cache_dir = cache_dir, sparse = sparse)
+
+        # reopens the preprocessed arrays if they were cached by a previous construction
+        if self._read_cache():
+            return
         
         # loads MNIST data
         (self._x_tr, self._y_tr), (self._x_te, self._y_te) = mnist.load_data()
@@ -145,8 +681,9 @@ class MNIST(DataLoader):
         assert self._y_tr.shape == (60000,)
         assert self._y_te.shape == (10000,)
 
-        # applying preprocessing transformations
+        # applying preprocessing transformations and caching the result
         self.preprocess()
+        self._write_cache()
 
 
     ## applies preprocessing trasformations for MNIST dataset
@@ -190,11 +727,27 @@ class CIFAR10(DataLoader):
 
         # create tf data loader object for CIFAR10 dataset with batch_size of 256
         tr_data = c.loader(batch_size = 256)
+
+        # the same with reproducible random crops, flips and brightness changes
+        tr_data = c.loader(batch_size = 256, tuned = True, augment = True, seed = 0)
     
     """
 
 
-    def __init__(self):
+    ## Constructs and object, loads CIFAR10 data, asserts that the subsets are of correct shape
+    #  and calls preprocess() method
+    #  @lazy: bool, if True images are kept as uint8 and scaled per batch, by default False
+    #  @cache_dir: str or None, directory of the cache of preprocessed arrays, by default None
+    #  @sparse: bool, if True labels are kept as int32 class indices, by default False
+    #
+    def __init__(self, lazy = False, cache_dir = None, sparse = False):
+
+        # calls the constructor method of DataLoader class
+        super().__init__(lazy = lazy, cache_dir = cache_dir, sparse = sparse)
+
+        # reopens the preprocessed arrays if they were cached by a previous construction
+        if self._read_cache():
+            return
                 
         # loads CIFAR10 data
         (self._x_tr, self._y_tr), (self._x_te, self._y_te) = cifar10.load_data()
@@ -205,9 +758,439 @@ class CIFAR10(DataLoader):
         assert self._y_tr.shape == (50000, 1)
         assert self._y_te.shape == (10000, 1)
         
-        # applying preprocessing transformations
+        # applying preprocessing transformations and caching the result
         self.preprocess()
-        
+        self._write_cache()
+
+
+
+
+class Synthetic(DataLoader):
+
+    """
+
+    Dataloader with deterministic synthetic images, which are generated on demand
+    so that the dataset can be much larger than MNIST or CIFAR10 and needs no download
+
+    Every image is a pattern of its class blended with noise, both are computed from a hash of 
+    the seed, the index of the image and the index of the pixel, so any batch of images can be 
+    generated independently of all others and always has the same values
+
+    Instance variables:
+
+        All instance variables are the same as in the superclass DataLoader,
+        x_tr, x_te, y_tr and y_te materialize the whole subset (in chunks) on first access
+
+        While calling the constructor method the following parameters are expected:
+            @n_tr: int, the number of images in the training subset, by default 60000
+            @n_te: int, the number of images in the test subset, by default 10000
+            @shape: tuple, the shape of one image, by default (784,) i.e. flattened MNIST images
+            @y_dim: int, the number of classes, by default 10
+            @seed: int, seed of the generated images, by default 0
+            @chunk_size: int, number of images generated at once when a whole subset is materialized, by default 4096
+            @lazy, @sparse: the same as in the superclass DataLoader
+
+    Public methods:
+
+        All public methods are the same as in the superclass DataLoader, 
+        loader() defaults to "index" shuffling, which never materializes the training subset
+
+    Examples of usage:
+
+        # create 600000 synthetic CIFAR10-shaped images
+        s = Synthetic(n_tr = 600000, shape = (32, 32, 3))
+
+        # create tf data loader object with batch_size of 256
+        tr_data = s.loader(batch_size = 256)
+
+    """
+
+    ## Constructs an object, no images are generated until they are requested
+    #
+    def __init__(self, n_tr = 60000, n_te = 10000, shape = (28 * 28,), y_dim = 10, seed = 0, chunk_size = 4096, 
+                 lazy = False, sparse = False):
+
+        # calls the constructor method of DataLoader class
+        super().__init__(lazy = lazy, sparse = sparse)
+
+        self._n = {"tr": n_tr, "te": n_te}
+        self._shape = tuple(shape)
+        self._y_dim = y_dim
+        self._seed = seed
+        self._chunk_size = chunk_size
+
+        # materialized subsets, filled on first access of x_tr, x_te, y_tr or y_te
+        self._materialized = {}
+
+        # test images continue the indices of the training images, as do validation images once they are split off
+        self._offset = {"tr": 0, "te": n_tr}
+
+        # one pattern per class
+        n_pixels = int(np.prod(self._shape))
+        self._patterns = self._byte(np.arange(y_dim * n_pixels, dtype = np.uint64), salt = 1).reshape((y_dim, n_pixels))
+
+
+    ## Prints a short description of the class
+    #
+    def __repr__(self):
+        return f"Synthetic dataset with {self._n['tr']} training and {self._n['te']} test images of shape {self._shape}."
+
+
+    ## Enables a user to load dataset in batches, see DataLoader.loader()
+    #  Shuffling is "index" by default, since "full" shuffling materializes the training subset
+    # 
+    def loader(self, batch_size, shuffle = "index", **kwargs):
+        return super().loader(batch_size, shuffle = shuffle, **kwargs)
+
+
+    ## Moves the last images of the training subset into the validation subset by shifting indices,
+    #  the test images keep their indices
+    #  @n_va: int, number of observations in the validation subset
+    #
+    def _split(self, n_va):
+        self._n["tr"] -= n_va
+        self._n["va"] = n_va
+        self._offset["va"] = self._n["tr"]
+        self._materialized.pop("tr", None)
+
+
+    ## Vectorized splitmix64 hash, deterministic for a given seed and salt
+    #  @z: array of uint64
+    #  @salt: int, distinguishes the hashes used for patterns, noise and labels
+    #  @return array of uint64, the full hash
+    #
+    def _hash(self, z, salt):
+        z = z + np.uint64((self._seed * 3 + salt) * 0x9E3779B97F4A7C15 % 2 ** 64)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return z ^ (z >> np.uint64(31))
+
+
+    ## The lowest byte of the hash, used for pixel values
+    #  @z, @salt: the same as in _hash()
+    #  @return array of uint8
+    #
+    def _byte(self, z, salt):
+        return (self._hash(z, salt) & np.uint64(0xFF)).astype(np.uint8)
+
+
+    ## Number of observations in a subset, known without generating it
+    #
+    def _size(self, subset):
+        return self._n[subset]
+
+
+    ## Dtypes and shapes of the generated features and labels, the same as after DataLoader.preprocess()
+    #
+    def _spec(self, subset):
+        x_dtype = np.uint8 if self._lazy else np.float32
+        if self._sparse:
+            return x_dtype, self._shape, np.int32, ()
+        return x_dtype, self._shape, np.float32, (self._y_dim,)
+
+
+    ## Generates the images and labels with the provided indices
+    #  @idx: array of int, indices of the observations
+    #  @subset: str, "tr" for the training subset and "te" for the test subset
+    #  @return a tuple (x, y) with the features and labels of the observations, preprocessed like in DataLoader
+    #
+    def _take(self, idx, subset = "tr"):
+
+        # global indices, validation and test images follow the training images
+        idx = np.asarray(idx, dtype = np.uint64) + np.uint64(self._offset[subset])
+        n_pixels = self._patterns.shape[1]
+
+        # labels are uniform over the classes, taken from the full hash so that more than 256 classes occur
+        y = (self._hash(idx, salt = 2) % np.uint64(self._y_dim)).astype(np.int32)
+
+        # half class pattern, half noise
+        noise = self._byte(idx[:, None] * np.uint64(n_pixels) + np.arange(n_pixels, dtype = np.uint64), salt = 3)
+        x = (self._patterns[y] >> 1) + (noise >> 1)
+        x = x.reshape((idx.shape[0],) + self._shape)
+
+        if not self._lazy:
+            x = (x / 255).astype(dtype = "float32")
+        if not self._sparse:
+            y = np.eye(self._y_dim, dtype = np.float32)[y]
+
+        return x, y
+
+
+    ## Materializes a whole subset, chunk by chunk into preallocated arrays
+    #  @subset: str, "tr" for the training subset and "te" for the test subset
+    #  @return a tuple (x, y) with the features and labels of the subset
+    #
+    def _arrays(self, subset):
+
+        if subset not in self._materialized:
+            x_dtype, x_shape, y_dtype, y_shape = self._spec(subset)
+            n = self._n[subset]
+            x = np.empty((n,) + tuple(x_shape), dtype = x_dtype)
+            y = np.empty((n,) + tuple(y_shape), dtype = y_dtype)
+
+            for start in range(0, n, self._chunk_size):
+                stop = min(start + self._chunk_size, n)
+                x[start:stop], y[start:stop] = self._take(np.arange(start, stop), subset)
+
+            self._materialized[subset] = (x, y)
+
+        return self._materialized[subset]
+
+
+
+class Sharded(DataLoader):
+
+    """
+
+    Dataloader that streams a dataset written by DataLoader.to_shards() from disk,
+    so that the dataset does not have to fit in memory
+
+    Shards are read in parallel with tf.data.Dataset.interleave and records are shuffled 
+    in a bounded buffer, so memory depends on the buffer size and not on the size of the dataset
+
+    Instance variables:
+
+        All instance variables are the same as in the superclass DataLoader,
+        x_tr, x_te, y_tr and y_te read the whole subset into memory on access
+
+        While calling the constructor method the following parameters are expected:
+            @directory: str, directory with the shards and index.json
+            @cycle_length: int, number of shards read in parallel, by default 4
+
+        lazy and sparse are taken from the index, i.e. they are the ones of the dataloader that wrote the shards,
+        so is the validation subset if it was split off before the shards were written
+
+    Public methods:
+
+        All public methods are the same as in the superclass DataLoader, 
+        loader() streams with "buffer" shuffling by default, "index" shuffling reads single records 
+        from memory-mapped shards and "full" shuffling is not supported
+
+    Examples of usage:
+
+        # write MNIST to shards once
+        MNIST().to_shards("shards/mnist")
+
+        # stream the shards in batches of 256
+        s = Sharded("shards/mnist")
+        tr_data = s.loader(batch_size = 256)
+
+    """
+
+    ## Constructs an object and reads the index, no records are read until they are requested
+    #
+    def __init__(self, directory, cycle_length = 4):
+
+        with open(os.path.join(directory, "index.json")) as f:
+            self._index = json.load(f)
+
+        # calls the constructor method of DataLoader class
+        super().__init__(lazy = self._index["lazy"], sparse = self._index["sparse"])
+
+        self._directory = directory
+        self._cycle_length = cycle_length
+        self._x_bytes = np.dtype(self._index["x_dtype"]).itemsize * int(np.prod(self._index["x_shape"]))
+        self._record = np.dtype([("x", np.dtype(self._index["x_dtype"]).newbyteorder("<"), tuple(self._index["x_shape"])),
+                                 ("y", np.dtype(self._index["y_dtype"]).newbyteorder("<"), tuple(self._index["y_shape"]))])
+
+        # shards written after DataLoader.split_validation() hold the validation subset as well
+        self._n_va = self._index["subsets"].get("va", {"n": 0})["n"]
+
+        # memory maps of the shards, opened on first random access
+        self._maps = {}
+
+
+    ## Prints a short description of the class
+    #
+    def __repr__(self):
+        return f"Sharded dataset in {self._directory}."
+
+
+    ## Enables a user to load dataset in batches, see DataLoader.loader()
+    #  "buffer" shuffling (the default) shuffles the order of the shards, interleaves cycle_length of them 
+    #  and shuffles records in a buffer of buffer_size records
+    #
+    def loader(self, batch_size, tuned = False, cache = False, deterministic = True, drop_remainder = False, 
+               shuffle = "buffer", buffer_size = None, augment = False, seed = None, skip = 0):
+
+        if shuffle == "full":
+            raise ValueError("'full' shuffling is not supported for sharded datasets, use 'buffer' or 'index'")
+
+        # random access to records of the memory-mapped shards
+        if shuffle == "index":
+            return super().loader(batch_size, tuned = tuned, cache = cache, deterministic = deterministic, 
+                                  drop_remainder = drop_remainder, shuffle = shuffle, buffer_size = buffer_size, 
+                                  augment = augment, seed = seed, skip = skip)
+
+        # parallelism is only used by the tuned pipeline, deterministic only affects parallel stages 
+        # and is left out of the basic pipeline, where tf.data warns that it has no effect
+        parallel = {"num_parallel_calls": tf.data.AUTOTUNE, "deterministic": deterministic} if tuned else {}
+        buffer_size = 16 * batch_size if buffer_size is None else buffer_size
+
+        # shards are read in parallel, their order is shuffled every epoch
+        files = self._files("tr")
+        tf_dl = tf.data.Dataset.from_tensor_slices(files).shuffle(len(files), seed = seed)
+        tf_dl = tf_dl.interleave(lambda f: tf.data.FixedLengthRecordDataset(f, self._index["record_bytes"]),
+                                 cycle_length = self._cycle_length, **parallel)
+
+        if tuned and cache:
+            tf_dl = tf_dl.cache()
+
+        # records are decoded one batch at a time, skipped batches are not decoded
+        tf_dl = tf_dl.shuffle(buffer_size, seed = seed).batch(batch_size, drop_remainder = drop_remainder).skip(skip)
+        tf_dl = tf_dl.map(self._decode, **parallel)
+
+        return self._finish(tf_dl, tuned = tuned, deterministic = deterministic, augment = augment, seed = seed, skip = skip)
+
+
+    ## Enables a user to load the test subset in batches of consecutive records, for evaluation
+    #  @batch_size: int, number of images in one batch
+    #  @subset: str, "te" for the test subset or "va" for the validation subset
+    #  @return tf data loader object
+    #
+    def test_loader(self, batch_size, subset = "te"):
+
+        tf_dl = tf.data.FixedLengthRecordDataset(self._files(subset), self._index["record_bytes"]).batch(batch_size)
+        tf_dl = tf_dl.map(self._decode, num_parallel_calls = tf.data.AUTOTUNE)
+
+        return self._finish(tf_dl, tuned = True, deterministic = True)
+
+
+    ## The subsets are fixed when the shards are written
+    #
+    def _split(self, n_va):
+        raise ValueError("sharded datasets cannot be split, split the dataset before writing the shards with to_shards()")
+
+
+    ## Paths of the shards of a subset
+    #  @subset: str, "tr" for the training subset and "te" for the test subset
+    #  @return list of str
+    #
+    def _files(self, subset):
+        return [os.path.join(self._directory, shard["file"]) for shard in self._index["subsets"][subset]["shards"]]
+
+
+    ## Decodes a batch of raw records into features and labels
+    #  @records: tensor of strings, raw records
+    #  @return a tuple (x, y) of tensors
+    #
+    def _decode(self, records):
+        x = tf.io.decode_raw(tf.strings.substr(records, 0, self._x_bytes), tf.as_dtype(self._index["x_dtype"]))
+        y = tf.io.decode_raw(tf.strings.substr(records, self._x_bytes, self._index["record_bytes"] - self._x_bytes), 
+                             tf.as_dtype(self._index["y_dtype"]))
+
+        x = tf.reshape(x, [-1] + self._index["x_shape"])
+        y = tf.reshape(y, [-1] + self._index["y_shape"])
+
+        return x, y
+
+
+    ## Number of observations in a subset, known from the index
+    #
+    def _size(self, subset):
+        return self._index["subsets"][subset]["n"]
+
+
+    ## Dtypes and shapes of the stored features and labels, known from the index
+    #
+    def _spec(self, subset):
+        return (np.dtype(self._index["x_dtype"]), tuple(self._index["x_shape"]), 
+                np.dtype(self._index["y_dtype"]), tuple(self._index["y_shape"]))
+
+
+    ## Reads the records with the provided indices from the memory-mapped shards
+    #  @idx: array of int, indices of the observations
+    #  @subset: str, "tr" for the training subset and "te" for the test subset
+    #  @return a tuple (x, y) with the features and labels of the observations
+    #
+    def _take(self, idx, subset = "tr"):
+
+        if subset not in self._maps:
+            maps = [np.memmap(f, dtype = self._record, mode = "r") for f in self._files(subset)]
+            starts = np.cumsum([0] + [m.shape[0] for m in maps])
+            self._maps[subset] = (maps, starts)
+
+        maps, starts = self._maps[subset]
+        idx = np.asarray(idx)
+        shard = np.searchsorted(starts, idx, side = "right") - 1
+
+        records = np.empty(idx.shape[0], dtype = self._record)
+        for s in np.unique(shard):
+            mask = shard == s
+            records[mask] = maps[s][idx[mask] - starts[s]]
+
+        return records["x"], records["y"]
+
+
+    ## Reads a whole subset into memory
+    #  @subset: str, "tr" for the training subset and "te" for the test subset
+    #  @return a tuple (x, y) with the features and labels of the subset
+    #
+    def _arrays(self, subset):
+        return self._take(np.arange(self._size(subset)), subset)
+
+
+
+class Shared(DataLoader):
+
+    """
+
+    Dataloader over arrays that another process copied into shared memory with DataLoader.to_shared_memory(),
+    so that many processes use one copy of the dataset and none of them loads or preprocesses it again
+
+    Instance variables:
+
+        All instance variables are the same as in the superclass DataLoader,
+        x_tr, x_te, y_tr and y_te are views of the shared memory blocks and must not be written to
+
+        While calling the constructor method the following parameters are expected:
+            @spec: dict, the description of the blocks returned by DataLoader.to_shared_memory()
+
+        lazy and sparse are taken from the spec, i.e. they are the ones of the dataloader that shared the arrays
+
+    Public methods:
+
+        All public methods are the same as in the superclass DataLoader
+
+    Examples of usage:
+
+        # in the parent process
+        spec, blocks = MNIST(lazy = True).to_shared_memory()
+
+        # in a worker process, spec is passed e.g. as an argument of the worker
+        d = Shared(spec)
+        tr_data = d.loader(batch_size = 256, shuffle = "index")
+
+    """
+
+    ## Constructs an object by attaching to the shared memory blocks
+    #
+    def __init__(self, spec):
+
+        # calls the constructor method of DataLoader class
+        super().__init__(lazy = spec["lazy"], sparse = spec["sparse"])
+
+        # the blocks are kept referenced, the views are only valid while they are attached
+        self._blocks = []
+        for key, array in spec["arrays"].items():
+            block = shared_memory.SharedMemory(name = array["name"])
+            self._blocks.append(block)
+            view = np.ndarray(tuple(array["shape"]), dtype = np.dtype(array["dtype"]), buffer = block.buf)
+            view.flags.writeable = False
+            setattr(self, "_" + key, view)
+
+        if "y_va" in spec["arrays"]:
+            self._n_va = self._y_va.shape[0]
+
+
+    ## Prints a short description of the class
+    #
+    def __repr__(self):
+        return f"Shared dataset with {self.n_tr} training and {self.n_te} test images."
+
+
+
+
 
 if __name__ == "__main__":
 
@@ -220,8 +1203,41 @@ if __name__ == "__main__":
     # create an object of class CIFAR10
     c = CIFAR10()
 
-    for obj in (m, c):
+    # create an object of class Synthetic and check that batches are deterministic
+    s = Synthetic(n_tr = 1000, n_te = 100)
+    assert (s._take(np.arange(10))[0] == s.x_tr[:10]).all()
+
+    for obj in (m, c, s):
     # create tf data loader object for MNIST dataset with batch_size of 256
     # create tf data loader object for CIFAR10 dataset with batch_size of 256
         tr_data = obj.loader(batch_size = 256)
 
+
+    # write small Synthetic datasets to shards, reopen them as Sharded and check that the records survive the roundtrip,
+    # several shards per subset with an incomplete last one, float32 one-hot and uint8 sparse records
+    for lazy, sparse in ((False, False), (True, True)):
+        s = Synthetic(n_tr = 300, n_te = 50, shape = (8, 8, 3), lazy = lazy, sparse = sparse)
+        s.split_validation(0.1)
+        with tempfile.TemporaryDirectory() as directory:
+            s.to_shards(directory, records_per_shard = 64)
+            sh = Sharded(directory)
+            assert (sh.n_tr, sh.n_va, sh.n_te) == (s.n_tr, s.n_va, s.n_te)
+
+            # random access across shard boundaries
+            idx = np.array([5, 0, 63, 64, 127, 128, s.n_tr - 1])
+            for a, b in zip(sh.take(idx), s.take(idx)):
+                assert a.dtype == b.dtype and (a == b).all()
+
+            # the same seed gives the same batches with "index" shuffling, "buffer" shuffling yields every record once
+            batches = zip(sh.loader(batch_size = 32, shuffle = "index", seed = 0), s.loader(batch_size = 32, shuffle = "index", seed = 0))
+            for a, b in batches:
+                assert all((u.numpy() == v.numpy()).all() for u, v in zip(a, b))
+            x = np.concatenate([x.numpy() for x, _ in sh.loader(batch_size = 32, shuffle = "buffer", seed = 0)])
+            assert sorted(r.tobytes() for r in x) == sorted(r.tobytes() for r in np.asarray(s.scale(s.x_tr)))
+
+            # the test and validation subsets are read in order
+            for subset in ("te", "va"):
+                batches = list(sh.test_loader(batch_size = 16, subset = subset))
+                x, y = (np.concatenate([t.numpy() for t in ts]) for ts in zip(*batches))
+                x_s, y_s = s._arrays(subset)
+                assert (x == np.asarray(s.scale(x_s))).all() and (y == y_s).all()
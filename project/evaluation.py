@@ -0,0 +1,182 @@
+## This file contains the StreamingAUC class and the collect_predictions(), evaluate() and score() functions
+#  that evaluate a trained neural network on the test subset in batches
+#  It also contains the tester function for the StreamingAUC class
+#
+
+# for preallocated predictions and histograms
+import numpy as np
+
+# for performance analysis
+from sklearn.metrics import roc_auc_score
+
+
+
+
+class StreamingAUC:
+
+    """
+
+    Histogram based estimate of the one-vs-rest macro averaged AUC,
+    which is updated batch by batch so that its memory does not grow with the number of observations
+
+    Instance variables:
+
+        While calling the constructor method the following parameters are expected:
+            @y_dim: int, the number of classes
+            @bins: int, the number of histogram bins on [0, 1], by default 1000
+
+    Public methods:
+
+        update(y, pi_hat)
+            Adds a batch of labels and (pseudo)probabilities to the histograms
+            @y: array, true class labels, either one-hot encoded or class indices
+            @pi_hat: array, predicted (pseudo)probabilities
+
+        result()
+            Computes the AUC from the histograms
+            @return auc: float, the one-vs-rest macro averaged AUC
+
+    Examples of usage:
+
+        # creates an estimate for 10 classes and feeds it one batch
+        auc = StreamingAUC(y_dim = 10)
+        auc.update(y, pi_hat)
+        print(auc.result())
+
+    """
+
+    ## Constructs an object with empty histograms
+    #  @y_dim: int, the number of classes
+    #  @bins: int, the number of histogram bins on [0, 1]
+    #
+    def __init__(self, y_dim, bins = 1000):
+        self._y_dim = y_dim
+        self._bins = bins
+
+        # counts of positive and negative observations per class and bin
+        self._pos = np.zeros((y_dim, bins), dtype = np.int64)
+        self._neg = np.zeros((y_dim, bins), dtype = np.int64)
+
+
+    ## Adds a batch of labels and (pseudo)probabilities to the histograms
+    #  @y: array, true class labels, either one-hot encoded or class indices
+    #  @pi_hat: array, predicted (pseudo)probabilities
+    #
+    def update(self, y, pi_hat):
+
+        y = np.asarray(y)
+        pi_hat = np.asarray(pi_hat)
+
+        # one-hot encoded labels are converted to class indices
+        if y.ndim > 1:
+            y = y.argmax(axis = 1)
+
+        # bin of every (observation, class) pair, flattened together with the class
+        # so that all histograms are updated with a single bincount
+        bins = np.clip((pi_hat * self._bins).astype(np.int64), 0, self._bins - 1)
+        flat = (np.arange(self._y_dim) * self._bins + bins).ravel()
+        positive = (y[:, None] == np.arange(self._y_dim)).ravel()
+
+        size = self._y_dim * self._bins
+        self._pos += np.bincount(flat[positive], minlength = size).reshape(self._y_dim, self._bins)
+        self._neg += np.bincount(flat[~positive], minlength = size).reshape(self._y_dim, self._bins)
+
+
+    ## Computes the AUC from the histograms
+    #  @return auc: float, the one-vs-rest macro averaged AUC
+    #
+    def result(self):
+
+        # negatives with a lower score than each bin, ties within a bin count as one half
+        neg_below = np.cumsum(self._neg, axis = 1) - self._neg
+        pairs = (self._pos * (neg_below + 0.5 * self._neg)).sum(axis = 1)
+        auc = pairs / (self._pos.sum(axis = 1) * self._neg.sum(axis = 1))
+
+        return float(auc.mean())
+
+
+
+
+## Generates (pseudo)probabilities for all batches of a data loader
+#  The predictions and labels are written into arrays preallocated for n observations
+#  @model: NeuralNetwork, a trained neural network
+#  @data: tf data loader object, yields tuples (x, y) of features and labels
+#  @n: int, the number of observations the data loader yields
+#  @return a tuple (pi_hat, y) of arrays with the predicted (pseudo)probabilities and the true labels
+#
+def collect_predictions(model, data, n):
+
+    pi_hat, y_true = None, None
+    start = 0
+    for x, y in data:
+        out = np.asarray(model.test(x))
+
+        # the arrays are allocated once the output shape is known
+        if pi_hat is None:
+            pi_hat = np.empty((n,) + out.shape[1:], dtype = out.dtype)
+            y_true = np.empty((n,) + tuple(y.shape[1:]), dtype = y.dtype.as_numpy_dtype)
+
+        pi_hat[start:start + out.shape[0]] = out
+        y_true[start:start + out.shape[0]] = y.numpy()
+        start += out.shape[0]
+
+    return pi_hat, y_true
+
+
+## Estimates the AUC of a trained neural network on the test subset of a data loader in batches
+#  @model: NeuralNetwork, a trained neural network
+#  @data_loader: DataLoader, data loader with the test subset
+#  @batch_size: int, number of images in one batch
+#  @streaming: bool, if True the AUC is estimated from histograms updated per batch (StreamingAUC),
+#              otherwise predictions are collected and the exact AUC is computed, by default False
+#  @y_dim: int, the number of classes, by default 10
+#  @subset: str, "te" for the test subset or "va" for the validation subset split off by DataLoader.split_validation()
+#  @return auc: float, the one-vs-rest macro averaged AUC
+#
+def evaluate(model, data_loader, batch_size, streaming = False, y_dim = 10, subset = "te"):
+
+    te_data = data_loader.test_loader(batch_size = batch_size, subset = subset)
+
+    # memory stays constant, only the histograms are kept between batches
+    if streaming:
+        auc = StreamingAUC(y_dim = y_dim)
+        for x, y in te_data:
+            auc.update(y.numpy(), model.test(x).numpy())
+        return auc.result()
+
+    pi_hat, y_true = collect_predictions(model, te_data, data_loader.n_va if subset == "va" else data_loader.n_te)
+
+    return score(y_true, pi_hat)
+
+
+## Computes the exact one-vs-rest macro averaged AUC of predictions
+#  @y_true: array, true class labels, either one-hot encoded or class indices
+#  @pi_hat: array, predicted (pseudo)probabilities
+#  @return auc: float
+#
+def score(y_true, pi_hat):
+
+    # class indices are one-hot encoded, the macro average of the per-class AUCs is the same as one-vs-rest,
+    # but unlike multi_class = "ovr" it does not require rows summing to 1, which dequantized int8 outputs do not
+    if y_true.ndim == 1:
+        y_true = y_true[:, None] == np.arange(pi_hat.shape[1])
+    return roc_auc_score(y_true, pi_hat)
+
+
+
+
+if __name__ == "__main__":
+
+    # testing StreamingAUC against the exact AUC on random scores
+    print("Testing StreamingAUC")
+    rng = np.random.default_rng(0)
+    y = rng.integers(0, 10, size = 5000)
+    pi_hat = rng.dirichlet(np.ones(10), size = 5000)
+    pi_hat[np.arange(5000), y] += 0.5
+    pi_hat /= pi_hat.sum(axis = 1, keepdims = True)
+
+    auc = StreamingAUC(y_dim = 10)
+    for start in range(0, 5000, 512):
+        auc.update(y[start:start + 512], pi_hat[start:start + 512])
+
+    assert abs(auc.result() - roc_auc_score(y, pi_hat, multi_class = "ovr")) < 1e-3
@@ -1,5 +1,6 @@
 
-## This file contains NeuralNetwork, FullyConNN, and ConvNN classes
+## This file contains NeuralNetwork, FullyConNN, and ConvNN classes, the ResidualBlock layer
+#  and the parse_spec() and layer_cost() functions that build hidden layers from a compact spec and estimate their cost
 #  It also contains the tester function for all classes
 # 
 
@@ -8,6 +9,205 @@ from tensorflow.keras import layers, Model
 from tensorflow.keras.models import Sequential
 import tensorflow as tf
 
+# for the cost estimate
+import math
+
+# for calibration data of quantized models
+import numpy as np
+
+
+
+
+## Parses a compact layer spec into a list of keras layers
+#  The spec is a comma separated list of layers, optional arguments are in square brackets:
+#      dense:UNITS[:ACTIVATION]                 fully connected layer
+#      conv:FILTERS:KERNEL[:STRIDE[:ACTIVATION]]  2D convolution with "same" padding
+#      sepconv:FILTERS:KERNEL[:STRIDE[:ACTIVATION]]  depthwise-separable 2D convolution with "same" padding
+#      res:WIDTH[:KERNEL[:ACTIVATION]]          residual block, see ResidualBlock
+#      pool:SIZE, avgpool:SIZE                  max and average pooling with strides of the pool size
+#      gap                                      global average pooling
+#      bn                                       batch normalization
+#      flatten                                  flattens the output of the previous layer
+#  ACTIVATION is any keras activation name, e.g. relu, gelu or tanh, layers have no activation by default
+#  @spec: str, e.g. "conv:32:3:1:relu,pool:2,res:64,gap" or "dense:256:relu,bn,dense:128:relu"
+#  @return list of keras layers
+#
+def parse_spec(spec):
+
+    result = []
+    for token in spec.split(","):
+        kind, *args = token.strip().split(":")
+        try:
+            if kind == "dense" and len(args) in (1, 2):
+                result.append(layers.Dense(int(args[0]), activation = args[1] if len(args) > 1 else None))
+            elif kind in ("conv", "sepconv") and len(args) in (2, 3, 4):
+                conv = layers.Conv2D if kind == "conv" else layers.SeparableConv2D
+                result.append(conv(filters = int(args[0]), kernel_size = int(args[1]), 
+                                            strides = int(args[2]) if len(args) > 2 else 1, padding = "same",
+                                            activation = args[3] if len(args) > 3 else None))
+            elif kind == "res" and len(args) in (1, 2, 3):
+                result.append(ResidualBlock(int(args[0]), kernel_size = int(args[1]) if len(args) > 1 else 3,
+                                            activation = args[2] if len(args) > 2 else "relu"))
+            elif kind in ("pool", "avgpool") and len(args) == 1:
+                pooling = layers.MaxPooling2D if kind == "pool" else layers.AveragePooling2D
+                result.append(pooling(pool_size = int(args[0])))
+            elif kind == "gap" and not args:
+                result.append(layers.GlobalAveragePooling2D())
+            elif kind == "bn" and not args:
+                result.append(layers.BatchNormalization())
+            elif kind == "flatten" and not args:
+                result.append(layers.Flatten())
+            else:
+                raise ValueError
+        except ValueError:
+            raise ValueError(f"invalid layer '{token}' in spec '{spec}'") from None
+
+    return result
+
+
+## Estimates the floating point operations of a layer for one observation, a multiply-add counts as two
+#  Layers without an estimate (e.g. activations or reshaping) count as free
+#  @layer: keras layer
+#  @input_shape: tuple, the shape of one observation the layer receives
+#  @return a tuple (flops, output_shape)
+#
+def layer_cost(layer, input_shape):
+
+    input_shape = tuple(input_shape)
+    output_shape = tuple(tf.TensorShape(layer.compute_output_shape((1,) + input_shape)).as_list()[1:])
+    size_in, size_out = math.prod(input_shape), math.prod(output_shape)
+
+    # separable and depthwise convolutions are subclasses of the convolution base class, so they go first
+    if hasattr(layer, "flops"):
+        flops = layer.flops(input_shape)
+    elif isinstance(layer, layers.SeparableConv2D):
+        positions = math.prod(output_shape[:-1])
+        depthwise = math.prod(layer.kernel_size) * input_shape[-1] * layer.depth_multiplier
+        flops = 2 * positions * (depthwise + input_shape[-1] * layer.depth_multiplier * output_shape[-1])
+    elif isinstance(layer, layers.DepthwiseConv2D):
+        flops = 2 * size_out * math.prod(layer.kernel_size)
+    elif isinstance(layer, layers.Conv2D):
+        flops = 2 * size_out * math.prod(layer.kernel_size) * input_shape[-1]
+    elif isinstance(layer, layers.Dense):
+        flops = 2 * size_out * input_shape[-1]
+    elif isinstance(layer, layers.BatchNormalization):
+        flops = 2 * size_in
+    elif isinstance(layer, (layers.MaxPooling2D, layers.AveragePooling2D, layers.GlobalAveragePooling2D)):
+        flops = size_in
+    else:
+        flops = 0
+
+    return flops, output_shape
+
+
+
+
+class ResidualBlock(layers.Layer):
+
+    """
+
+    Residual block of two convolutions (for inputs of shape (height, width, channels)) or 
+    two dense layers (for flat inputs), each followed by batch normalization, 
+    whose output is added to the input, which is projected to the width of the block if necessary
+
+    Instance variables:
+
+        While calling the constructor method the following parameters are expected:
+            @width: int, the number of filters or neurons of both layers
+            @kernel_size: int, kernel size of the convolutions, by default 3
+            @activation: str, keras activation after the first layer and after the addition, by default "relu"
+
+    Public methods:
+
+        flops(input_shape)
+            Estimates the floating point operations for one observation
+            @input_shape: tuple, the shape of one observation the block receives
+            @return int
+
+    Examples of usage:
+
+        # residual block with 64 filters on CIFAR10 images
+        block = ResidualBlock(64)
+        out = block(tf.zeros((1, 32, 32, 3)))
+
+    """
+
+    ## Constructs a block, its layers are created once the shape of the input is known
+    #
+    def __init__(self, width, kernel_size = 3, activation = "relu", **kwargs):
+        super().__init__(**kwargs)
+        self._width = width
+        self._kernel_size = kernel_size
+        self._activation = tf.keras.activations.get(activation)
+
+
+    ## Creates the layers of the block for the shape of the input
+    #  @input_shape: TensorShape including the batch dimension
+    #
+    def build(self, input_shape):
+
+        if len(input_shape) == 4:
+            layer = lambda width, kernel_size: layers.Conv2D(width, kernel_size, padding = "same")
+        else:
+            layer = lambda width, kernel_size: layers.Dense(width)
+
+        self._first = layer(self._width, self._kernel_size)
+        self._second = layer(self._width, self._kernel_size)
+        self._first_bn = layers.BatchNormalization()
+        self._second_bn = layers.BatchNormalization()
+
+        # the skip connection is projected only if the widths differ
+        self._projection = layer(self._width, 1) if input_shape[-1] != self._width else None
+
+        super().build(input_shape)
+
+
+    ## Applies the block
+    #  @x: tensor, the input of the block
+    #  @training: bool or None, whether batch normalization uses batch statistics
+    #  @return tensor
+    #
+    def call(self, x, training = None):
+        out = self._activation(self._first_bn(self._first(x), training = training))
+        out = self._second_bn(self._second(out), training = training)
+        skip = x if self._projection is None else self._projection(x)
+        return self._activation(out + skip)
+
+
+    ## The output has the width of the block
+    #
+    def compute_output_shape(self, input_shape):
+        return tf.TensorShape(input_shape)[:-1].concatenate([self._width])
+
+
+    ## Estimates the floating point operations for one observation
+    #  @input_shape: tuple, the shape of one observation the block receives
+    #  @return int
+    #
+    def flops(self, input_shape):
+
+        # the layers are only created once the block is built
+        if not self.built:
+            self.build(tf.TensorShape((None,) + tuple(input_shape)))
+
+        total, shape = 0, tuple(input_shape)
+        for layer in (self._first, self._first_bn, self._second, self._second_bn):
+            flops, shape = layer_cost(layer, shape)
+            total += flops
+        if self._projection is not None:
+            total += layer_cost(self._projection, input_shape)[0]
+
+        # the addition of the skip connection
+        return total + math.prod(shape)
+
+
+    ## Configuration of the block, so that models with it can be saved
+    #
+    def get_config(self):
+        return dict(super().get_config(), width = self._width, kernel_size = self._kernel_size,
+                    activation = tf.keras.activations.serialize(self._activation))
+
+
 
 
 
@@ -20,10 +220,19 @@ class NeuralNetwork(Model):
     Instance variables:
 
         _cls: classification layer of a neural network.
+        sample_shape: tuple, the shape of one observation the hidden layers expect, without the batch dimension
 
         While calling the constructor method the following parameters are expected:
-            @neurons: int, the number of neurons in the last layer before the classification layer
+            @neurons: int or None, the number of neurons in the last layer before the classification layer,
+                      None defers the classification layer until the hidden layers are known
             @y_dim: int, the number of classes the model is intended to identify
+            @sparse: bool, if True labels are int32 class indices instead of one-hot encoded vectors, by default False
+            @fused: bool, if True the hidden layers and the classification layer are applied as a single model, 
+                    whose classification layer emits logits, the loss is the fused softmax cross-entropy 
+                    on the logits and test() applies the softmax, by default False
+            @logits: bool, if True the classification layer emits logits, the loss is computed on the logits 
+                     and test() applies the softmax, so the softmax is computed once per step, 
+                     implied by fused, by default False
 
     Public methods:
 
@@ -37,7 +246,7 @@ class NeuralNetwork(Model):
             to generate (pseudo)probabilities  based on observed features and calculates 
             a loss function given true labels and (pseudo)probabilities
             @x: array of features (e.g. images)
-            @y: array of true class labels, one-hot encoded
+            @y: array of true class labels, one-hot encoded or class indices if the model is sparse
             @return loss: array, the result of appliction of the loss function given true labels and (pseudo)probabilities
 
         train(inputs, optimizer)
@@ -46,11 +255,64 @@ class NeuralNetwork(Model):
             @optimizer: optimizer object from keras, optimizer to be used for training of a neural network 
             @return loss: array, the result of appliction of the loss function given true labels and (pseudo)probabilities
 
+        train_loop(iterator, optimizer)
+            Runs up to steps_per_call training steps on batches of an iterator in a single call
+            @iterator: iterator over a tf data loader object (or a distributed one)
+            @optimizer: optimizer object from keras, optimizer to be used for training of a neural network 
+            @return steps: int tensor, the number of steps run, 0 once the iterator is exhausted
+
+        compile_train(optimizer, jit_compile = False, batch_size = None, strategy = None, steps_per_call = 1)
+            Compiles the training step into a tf.function graph, which is traced once and 
+            afterwards used by train() whenever it is called with the same optimizer
+            @optimizer: optimizer object from keras, optimizer the compiled step applies gradients with
+            @jit_compile: bool, whether the graph should additionally be compiled with XLA
+            @batch_size: int or None, fixes the batch dimension of the input signature, None keeps it variable
+            @strategy: tf.distribute strategy or None, if provided the step runs on every replica of the strategy
+                       and expects distributed batches, the model and optimizer should be created in its scope
+            @steps_per_call: int, number of steps train_loop() runs in one graph call, so that python 
+                             and the host only see every steps_per_call-th step
+
+        running_loss()
+            The mean loss of all steps since the last reset_running_loss() and the loss of the last step,
+            both are accumulated on the device by every training step, reading them waits for the steps to finish
+            @return a tuple (mean, last) of scalar tensors
+
+        reset_running_loss()
+            Resets the mean loss, e.g. at the beginning of an epoch
+
         test(x)
             Generates (pseudo)probabilities for provided observations without true labels
             @x: array, features of observations (e.g. images) for which (pseudo)probabilities should be calculated
             @return pi_hat: array, predicted (pseudo)probabilities
 
+        export_artifact(path, format = "saved_model", quantize = None, calibration = None)
+            Exports test() with a fixed input signature as an inference artifact, 
+            which can be loaded by predict.py without the model classes or the training code
+            @path: str, directory of the SavedModel or path of the .tflite file
+            @format: str, "saved_model" or "tflite"
+            @quantize, @calibration: the same as in to_tflite(), only for the "tflite" format
+
+        to_tflite(quantize = None, calibration = None)
+            Converts test() into a TFLite model
+            @quantize: str or None, "dynamic" stores the weights as int8, "int8" quantizes weights and activations 
+                       including the input and output, None keeps float32
+            @calibration: array, scaled observations used to calibrate the ranges of the activations, required for "int8"
+            @return bytes, the content of the .tflite file
+
+        set_profiler(profiler)
+            Reports the "forward", "gradient" and "apply" phases of eagerly run training steps to a profiler,
+            in compiled steps the phases are name scopes, which show up in TensorBoard traces
+            @profiler: Profiler from profiling.py or None
+
+        spec_layers(spec, input_shape)
+            Defines the hidden layers from a compact layer spec, see parse_spec()
+            @spec: str, the layer spec, e.g. "dense:256:relu,bn,dense:128:relu"
+            @input_shape: the shape of one observation
+
+        cost()
+            Estimates the number of parameters and the floating point operations of a forward pass for one observation
+            @return dict with "params" and "flops"
+
     Examples of usage:
 
         # creates a neural network with a classification layer that expects the last hidden 
@@ -59,22 +321,61 @@ class NeuralNetwork(Model):
 
         # Since this class is a superclass for the purposes of this project and doesn't contain hidden layers
         # other method calls (expect for print(nn)) are not expected
+
+        # mixed precision: hidden layers follow the global keras policy, e.g. bfloat16 compute with float32 
+        # variables, while the classification layer, and with it the softmax and the loss, always stays float32
+        tf.keras.mixed_precision.set_global_policy("mixed_bfloat16")
+        fcnn = FullyConNN(neurons = 50, y_dim = 10)
     
     """
 
     ## Defines instance variables of the superclass Model and calls 
     #  classifier() method to add the output layer 
     #  for classification problem  
-    #  @neurons: int, the number of neurons in the last layer before the classification layer
+    #  @neurons: int or None, the number of neurons in the last layer before the classification layer,
+    #           None defers the classification layer to _finalize()
     #  @y_dim: int, the number of classes the model is intended to identify
+    #  @sparse: bool, if True labels are int32 class indices, by default False
+    #  @fused: bool, if True the layers are applied as a single model that emits logits, by default False
+    #  @logits: bool, if True the classification layer emits logits, by default False
     # 
-    def __init__(self, neurons, y_dim):
+    def __init__(self, neurons, y_dim, sparse = False, fused = False, logits = False):
         
         # calls the constructor method of a superclass imported from tf.keras
         super().__init__()
+
+        # whether labels are class indices or one-hot encoded
+        self._sparse = sparse
+
+        # the single model over all layers, defined by _finalize() if the forward pass is fused
+        self._fused = fused
+        self._net = None
+
+        # whether the classification layer emits logits instead of (pseudo)probabilities
+        self._logits = logits or fused
         
-        # creates an instance variable that contains classification layer
-        self.classifier(neurons = neurons, y_dim = y_dim)
+        # creates an instance variable that contains classification layer,
+        # unless its input width is only known once the hidden layers are defined
+        self._y_dim = y_dim
+        self._cls = None
+        if neurons is not None:
+            self.classifier(neurons = neurons, y_dim = y_dim)
+
+        # compiled training step and id of the optimizer it was compiled for,
+        # both are defined by compile_train(), until then train() runs eagerly
+        self._compiled_train = None
+        self._compiled_optimizer_id = None
+
+        # compiled loop over several steps, defined by compile_train() if steps_per_call > 1
+        self._compiled_loop = None
+
+        # profiler the phases of eager training steps are reported to, see set_profiler()
+        self._profiler = None
+
+        # the loss stays on the device, so that training steps never wait for the host,
+        # under a distribution strategy the last loss is averaged over the replicas
+        self._loss_mean = tf.keras.metrics.Mean(name = "loss")
+        self._last_loss = tf.Variable(0.0, trainable = False, aggregation = tf.VariableAggregation.MEAN)
 
 
     ## Prints a short description of the class
@@ -83,6 +384,14 @@ class NeuralNetwork(Model):
         return "Neural Network designed for classification problems."
 
 
+    ## Accessor for the shape of one observation the hidden layers expect
+    #  Named differently from keras' input_shape, which includes the batch dimension
+    #
+    @property
+    def sample_shape(self):
+        return tuple(self._hidden.input_shape[1:])
+
+
     ## Adds the classification layer
     #  @neurons: int, the number of neurons in the last layer before the classification layer
     #  @y_dim: int, the number of classes the model is intended to identify 
@@ -90,51 +399,256 @@ class NeuralNetwork(Model):
     def classifier(self, neurons, y_dim):
 
         # creates an instance variable that contains classification layer
+        # it is kept in float32 under mixed precision policies, so that the softmax and the loss are numerically stable,
+        # with logits the softmax is left to the loss and to test()
         self._cls = Sequential([layers.InputLayer(input_shape = neurons), 
-                                layers.Dense(y_dim, activation='softmax')])
+                                layers.Dense(y_dim, activation = None if self._logits else 'softmax', dtype = "float32")])
+
+
+    ## Defines the hidden layers from a compact layer spec, see parse_spec()
+    #  @spec: str, the layer spec
+    #  @input_shape: the shape of one observation
+    #
+    def spec_layers(self, spec, input_shape):
+        self._hidden = Sequential([layers.InputLayer(input_shape = input_shape)] + parse_spec(spec))
+
+
+    ## Collects the trainable variables into _params and, if the forward pass is fused, 
+    #  chains the layers of _hidden and _cls into the single model _net, which shares their variables
+    #  Called by subclasses once _hidden is defined, a deferred classification layer is created here
+    #
+    def _finalize(self):
+
+        # the classification layer expects flat inputs of the width of the last hidden layer
+        if len(self._hidden.output_shape) > 2:
+            self._hidden.add(layers.Flatten())
+        if self._cls is None:
+            self.classifier(neurons = self._hidden.output_shape[-1], y_dim = self._y_dim)
+
+        # the order of the parameters is the classification layer first, then the hidden layer(s)
+        self._params = self._cls.trainable_variables + self._hidden.trainable_variables
+
+        if self._fused:
+            self._net = Sequential([layers.InputLayer(input_shape = self.sample_shape)] 
+                                   + self._hidden.layers + self._cls.layers)
 
 
     ## Given the features and true class labels, uses the neural network 
     #  to generate (pseudo)probabilities  based on observed features and calculates 
     #  a loss function given true labels and (pseudo)probabilities
     #  @x: array of features (e.g. images)
-    #  @y: array of true class labels, one-hot encoded
+    #  @y: array of true class labels, one-hot encoded or class indices if the model is sparse
     #  @return loss: array, the result of application of the loss function given true labels and (pseudo)probabilities
     #  
     def call(self, x, y):
-        
-        # applies hidden layer(s) transformations to features contained in x
-        out = self._hidden(x)
 
-        # applies classification layer to the output of hidden layer(s)
-        out = self._cls(out)
+        # the fused model goes from features to logits in one call,
+        # layers run in training mode so that batch normalization uses and updates batch statistics
+        if self._fused:
+            out = self._net(x, training = True)
+
+        else:
+            # applies hidden layer(s) transformations to features contained in x
+            out = self._hidden(x, training = True)
+
+            # applies classification layer to the output of hidden layer(s)
+            out = self._cls(out)
         
-        # calculates the loss function 
-        loss = tf.reduce_mean(tf.nn.softmax_cross_entropy_with_logits(y, out))
+        # calculates the loss function, sparse labels avoid materializing one-hot vectors,
+        # the loss applies its own softmax, which only matches the model if the classification layer emits logits
+        if self._sparse:
+            loss = tf.reduce_mean(tf.nn.sparse_softmax_cross_entropy_with_logits(y, out))
+        else:
+            loss = tf.reduce_mean(tf.nn.softmax_cross_entropy_with_logits(y, out))
         
         return loss
     
 
     ## Updates model parameters using the provided optimizer 
+    #  Uses the compiled step if compile_train() was called with the same optimizer,
+    #  otherwise runs eagerly which is useful for debugging
     #  @inputs: a tuple (x, y) which contains an array of features and an array of labels 
     #  @optimizer: optimizer object from keras, optimizer to be used for training of a neural network 
     #  @return loss: array, the result of appliction of the loss function given true labels and (pseudo)probabilities
     # 
     def train(self, inputs, optimizer):
 
+        # runs the graph traced by compile_train() 
+        if self._compiled_train is not None and self._compiled_optimizer_id == id(optimizer):
+            return self._compiled_train(*inputs)
+
+        return self._train_step(*inputs, optimizer)
+
+
+    ## Runs up to steps_per_call training steps on batches of an iterator in a single call
+    #  Without a compiled loop for the optimizer a single step is run
+    #  @iterator: iterator over a tf data loader object (or a distributed one)
+    #  @optimizer: optimizer object from keras, optimizer to be used for training of a neural network 
+    #  @return steps: int tensor, the number of steps run, 0 once the iterator is exhausted
+    #
+    def train_loop(self, iterator, optimizer):
+
+        if self._compiled_loop is not None and self._compiled_optimizer_id == id(optimizer):
+            return self._compiled_loop(iterator)
+
+        inputs = next(iterator, None)
+        if inputs is None:
+            return tf.constant(0)
+        self.train(inputs, optimizer)
+        return tf.constant(1)
+
+
+    ## The mean loss since the last reset_running_loss() and the loss of the last step
+    #  @return a tuple (mean, last) of scalar tensors
+    #
+    def running_loss(self):
+        return self._loss_mean.result(), tf.convert_to_tensor(self._last_loss)
+
+
+    ## Resets the mean loss
+    #
+    def reset_running_loss(self):
+        self._loss_mean.reset_state()
+
+
+    ## Compiles the training step into a tf.function graph
+    #  @optimizer: optimizer object from keras, optimizer the compiled step applies gradients with
+    #  @jit_compile: bool, whether the graph should additionally be compiled with XLA
+    #  @batch_size: int or None, fixes the batch dimension of the input signature, None keeps it variable
+    #  @strategy: tf.distribute strategy or None, if provided the step runs on every replica of the strategy
+    #  @steps_per_call: int, number of steps train_loop() runs in one graph call
+    #
+    def compile_train(self, optimizer, jit_compile = False, batch_size = None, strategy = None, steps_per_call = 1):
+
+        self._compiled_loop = None
+        if strategy is not None:
+
+            # XLA cannot compile the cross-replica gradient aggregation done by the optimizer
+            if jit_compile:
+                raise ValueError("jit_compile is not supported together with a distribution strategy")
+
+            # runs the step on every replica, gradients are summed across replicas by the optimizer
+            # and the losses of the replicas are averaged
+            def distributed_step(x, y):
+                losses = strategy.run(self._train_step, args = (x, y, optimizer))
+                return strategy.reduce(tf.distribute.ReduceOp.MEAN, losses, axis = None)
+
+            # distributed batches are not plain tensors, so there is no input signature
+            self._compiled_train = tf.function(distributed_step)
+            self._compiled_optimizer_id = id(optimizer)
+            self._compile_loop(steps_per_call)
+            return
+
+        # the input signature follows the shapes expected by the hidden and classification layers,
+        # so the step is traced once instead of once per distinct batch shape
+        x_spec = tf.TensorSpec(shape = (batch_size,) + self.sample_shape, dtype = tf.float32)
+        if self._sparse:
+            y_spec = tf.TensorSpec(shape = (batch_size,), dtype = tf.int32)
+        else:
+            y_spec = tf.TensorSpec(shape = (batch_size,) + tuple(self._cls.output_shape[1:]), dtype = tf.float32)
+
+        # wraps the training step, the optimizer is captured by the closure 
+        def step(x, y):
+            return self._train_step(x, y, optimizer)
+
+        self._compiled_train = tf.function(step, input_signature = [x_spec, y_spec], jit_compile = jit_compile)
+        self._compiled_optimizer_id = id(optimizer)
+        self._compile_loop(steps_per_call)
+
+
+    ## Wraps the compiled step into a graph that runs up to steps_per_call steps per call
+    #  The loop itself is not compiled with XLA, since XLA cannot compile the iterator ops, 
+    #  the step inside of it keeps its own jit_compile setting
+    #  @steps_per_call: int, number of steps in one call, 1 compiles no loop
+    #
+    def _compile_loop(self, steps_per_call):
+
+        if steps_per_call <= 1:
+            return
+        step = self._compiled_train
+
+        def loop(iterator):
+            steps = tf.constant(0)
+            for _ in tf.range(steps_per_call):
+                inputs = iterator.get_next_as_optional()
+                if not inputs.has_value():
+                    break
+                step(*inputs.get_value())
+                steps += 1
+            return steps
+
+        self._compiled_loop = tf.function(loop)
+
+
+    ## Computes the loss and gradients for one batch and applies them
+    #  @x: array of features (e.g. images)
+    #  @y: array of true class labels, one-hot encoded or class indices if the model is sparse
+    #  @optimizer: optimizer object from keras
+    #  @return loss: array, the result of appliction of the loss function given true labels and (pseudo)probabilities
+    # 
+    def _train_step(self, x, y, optimizer):
+
         # creates a type object from tensorflow
-        with tf.GradientTape() as tape:
+        with tf.GradientTape() as tape, self._phase("forward"):
             
             # calls call() method on provided features and labels
-            loss = self.call(*inputs)
+            loss = self.call(x, y)
+
+            # under a distribution strategy every replica sees a part of the batch,
+            # dividing by the number of replicas makes the summed gradients those of the mean loss
+            scaled_loss = loss / tf.distribute.get_strategy().num_replicas_in_sync
+
+            # float16 gradients underflow without loss scaling, bfloat16 has the range of float32 and needs none
+            if isinstance(optimizer, tf.keras.mixed_precision.LossScaleOptimizer):
+                scaled_loss = optimizer.get_scaled_loss(scaled_loss)
+
+        # the loss is accumulated on the device, reading it is left to the caller, see running_loss()
+        self._loss_mean.update_state(loss)
+        self._last_loss.assign(loss)
 
         # calculates gradients
-        gradients = tape.gradient(loss, self._params)
+        with self._phase("gradient"):
+            gradients = tape.gradient(scaled_loss, self._params)
+            if isinstance(optimizer, tf.keras.mixed_precision.LossScaleOptimizer):
+                gradients = optimizer.get_unscaled_gradients(gradients)
 
         # updates the model parameters given the gradients and previously used parameters
-        optimizer.apply_gradients(zip(gradients, self._params))
+        with self._phase("apply"):
+            optimizer.apply_gradients(zip(gradients, self._params))
         
         return loss
+
+
+    ## Estimates the number of parameters and the floating point operations of a forward pass for one observation
+    #  @return dict with "params" and "flops"
+    #
+    def cost(self):
+
+        flops, shape = 0, self.sample_shape
+        for layer in self._hidden.layers + self._cls.layers:
+            layer_flops, shape = layer_cost(layer, shape)
+            flops += layer_flops
+
+        params = sum(math.prod(v.shape) for v in self._params)
+
+        return {"params": int(params), "flops": int(flops)}
+
+
+    ## Reports the phases of eagerly run training steps to a profiler
+    #  @profiler: Profiler from profiling.py or None
+    #
+    def set_profiler(self, profiler):
+        self._profiler = profiler
+
+
+    ## Context of one phase of the training step, timed by the profiler when running eagerly,
+    #  otherwise a name scope, since python timers only see the tracing of compiled steps
+    #  @name: str, the name of the phase
+    #
+    def _phase(self, name):
+        if self._profiler is not None and tf.executing_eagerly():
+            return self._profiler.phase(name)
+        return tf.name_scope(name)
     
 
     ## Generates (pseudo)probabilities for provided observations without true labels
@@ -142,16 +656,90 @@ class NeuralNetwork(Model):
     #  @return pi_hat: array, predicted (pseudo)probabilities
     # 
     def test(self, x):
-        
-        # applies hidden layer(s) transformations to features contained in x
-        out = self._hidden(x)
-        
-        # applies classification layer to the output of hidden layer(s)
-        pi_hat = self._cls(out)
+
+        # the fused model goes from features to logits in one call
+        if self._fused:
+            out = self._net(x)
+
+        else:
+            # applies hidden layer(s) transformations to features contained in x
+            out = self._hidden(x)
+            
+            # applies classification layer to the output of hidden layer(s)
+            out = self._cls(out)
+
+        # logits are turned into (pseudo)probabilities only for predictions
+        pi_hat = tf.nn.softmax(out) if self._logits else out
 
         return pi_hat
 
 
+    ## Exports test() with a fixed input signature as an inference artifact
+    #  @path: str, directory of the SavedModel or path of the .tflite file
+    #  @format: str, "saved_model" or "tflite"
+    #  @quantize, @calibration: the same as in to_tflite(), only for the "tflite" format
+    #
+    def export_artifact(self, path, format = "saved_model", quantize = None, calibration = None):
+
+        if format not in ("saved_model", "tflite"):
+            raise ValueError("format should be either 'saved_model' or 'tflite'")
+
+        if format == "saved_model":
+            if quantize is not None:
+                raise ValueError("quantization is only supported for the 'tflite' format")
+            module = self._serving_module()
+            tf.saved_model.save(module, path, signatures = {"serving_default": module.test})
+            return
+
+        with open(path, "wb") as f:
+            f.write(self.to_tflite(quantize = quantize, calibration = calibration))
+
+
+    ## Converts test() into a TFLite model
+    #  @quantize: str or None, "dynamic" (int8 weights), "int8" (int8 weights, activations, input and output) or None
+    #  @calibration: array, scaled observations used to calibrate the ranges of the activations, required for "int8"
+    #  @return bytes, the content of the .tflite file
+    #
+    def to_tflite(self, quantize = None, calibration = None):
+
+        if quantize not in (None, "dynamic", "int8"):
+            raise ValueError("quantize should be None, 'dynamic' or 'int8'")
+        if quantize == "int8" and calibration is None:
+            raise ValueError("full integer quantization requires calibration data")
+
+        module = self._serving_module()
+        converter = tf.lite.TFLiteConverter.from_concrete_functions([module.test.get_concrete_function()], module)
+
+        # dynamic range quantization stores the weights as int8 and quantizes activations on the fly
+        if quantize is not None:
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+
+        # full integer quantization fixes the ranges of all activations from the calibration data,
+        # so that every op, including the input and the output, runs in int8
+        if quantize == "int8":
+            calibration = np.asarray(calibration, dtype = np.float32)
+            converter.representative_dataset = lambda: ([calibration[i:i + 1]] for i in range(calibration.shape[0]))
+            converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+            converter.inference_input_type = tf.int8
+            converter.inference_output_type = tf.int8
+
+        return converter.convert()
+
+
+    ## Wraps the layers and test() into a module with a fixed input signature
+    #  Only the layers and test() are exported, the loss and the training step are left out,
+    #  the batch dimension stays variable so that the artifact can score batches of any size
+    #  @return tf.Module
+    #
+    def _serving_module(self):
+        module = tf.Module()
+        module.hidden = self._hidden
+        module.cls = self._cls
+        module.test = tf.function(lambda x: self.test(x), 
+                                  input_signature = [tf.TensorSpec((None,) + self.sample_shape, tf.float32, name = "x")])
+        return module
+
+
 
 class FullyConNN(NeuralNetwork):
 
@@ -167,6 +755,12 @@ class FullyConNN(NeuralNetwork):
         While calling the constructor method the following parameters are expected:
             @neurons: int, the number of neurons in the last layer before the classification layer
             @y_dim: int, the number of classes the model is intended to identify
+            @sparse: bool, if True labels are int32 class indices, by default False
+            @fused: bool, applies all layers as a single model that emits logits, by default False
+            @logits: bool, the classification layer emits logits and test() applies the softmax, by default False
+            @spec: str or None, layer spec of the hidden layers (see parse_spec()), which replaces the two default 
+                   dense layers, neurons is then ignored and the classification layer follows the last hidden layer, 
+                   by default None
 
     Public methods:
 
@@ -183,30 +777,42 @@ class FullyConNN(NeuralNetwork):
         # Furthemore, it already has two hidden layers with 50 neurons in each layer
         fcnn = FullyConNN(neurons = 50, y_dim = 10)
 
+        # a deeper network with batch normalization and a residual block
+        deep = FullyConNN(neurons = None, y_dim = 10, spec = "dense:256:relu,bn,res:256,dense:128:relu")
+        print(deep.cost())
+
     """
 
     ## Defines instance variables 
     #  @neurons: int, the number of neurons in the last layer before the classification layer
     #  @y_dim: int, the number of classes the model is intended to identify
     #  @input_shape: the size of a vector of features for each observation, default value of (28 * 28) is for MNIST dataset 
+    #  @sparse: bool, if True labels are int32 class indices, by default False
+    #  @fused: bool, applies all layers as a single model that emits logits, by default False
+    #  @logits: bool, the classification layer emits logits and test() applies the softmax, by default False
+    #  @spec: str or None, layer spec of the hidden layers, which replaces the default ones, by default None
     # 
-    def __init__(self, neurons, y_dim, input_shape = (28 * 28)):
+    def __init__(self, neurons, y_dim, input_shape = (28 * 28), sparse = False, fused = False, logits = False, spec = None):
 
         # calls the constructor method of NeuralNetwork class
         # as a result a classification layer is created with provided number 
         # of neurons (neurons parameter) expected from the last hidden layer 
         # and appropriate number of clases the model should identify (y_dim parameter)
         #  
-        super().__init__(neurons = neurons, y_dim = y_dim)
+        # with a spec the classification layer is created once the width of the last hidden layer is known
+        super().__init__(neurons = None if spec else neurons, y_dim = y_dim, sparse = sparse, fused = fused, logits = logits)
 
         # calls hidden_layers() method to define self._hidden 
         # uses default values of input_shape, because in this assignment
         # we are asked to use fully connected neural network only for MNIST dataset
-        self.hidden_layers(neurons = neurons, input_shape = input_shape)
+        if spec:
+            self.spec_layers(spec, input_shape = input_shape)
+        else:
+            self.hidden_layers(neurons = neurons, input_shape = input_shape)
 
         # defines _params instance variable that is going to store
         # trainable_variables from hidden layer(s) and classification layer  
-        self._params = self._cls.trainable_variables + self._hidden.trainable_variables
+        self._finalize()
 
 
     ## Prints a short description of the class
@@ -245,39 +851,60 @@ class ConvNN(NeuralNetwork):
             @filters: int, the number of filters to be used in the first convolutional layer, and half the number of filters for the second convolutional layer, by default equals to 32
             @kernel_size: int, kernel size to be used in all three convolutional layers, by default is equal to 3
             @strides: tuple, strides to be used in the first two convolutional layers, by default is (2, 2)
+            @sparse: bool, if True labels are int32 class indices, by default False
+            @fused: bool, applies all layers as a single model that emits logits, by default False
+            @logits: bool, the classification layer emits logits and test() applies the softmax, by default False
+            @spec: str or None, layer spec of the hidden layers (see parse_spec()), which replaces the three default 
+                   convolutions, neurons, filters, kernel_size and strides are then ignored, by default None
+            @separable: bool, if True the second and third convolutions are depthwise-separable and the output of the
+                        last one is averaged over all positions instead of being taken at a stride of 5, 
+                        which needs about 2.8x fewer FLOPs than the default layout, by default False
 
     Public methods:
 
-        hidden_layers(neurons, input_shape, filters, kernel_size, strides)
+        hidden_layers(neurons, input_shape, filters, kernel_size, strides, separable = False)
             Defines three convolutional layers in two dimensions and flattens the output of the last one
             @neurons: int, the number filters to use in the last convolutional layer
             @input_shape: tuple, the dimensions of input observations
             @filters: int, the number of filters to be used in the first convolutional layer, and half the number of filters for the second convolutional layer
             @kernel_size: int, kernel size to be used in all three convolutional layers
             @strides: tuple, strides to be used in the first two convolutional layers
+            @separable: bool, uses depthwise-separable convolutions and global average pooling for the last two layers
         
     Examples of usage:
 
         # creates a convolutional neural network with three convolutional layers and a classication layer
         # expects an input shape of images to be (32, 32, 3) i.e. size of CIFAR10 images
         cnn = ConvNN(neurons = 50, y_dim = 10)
+
+        # the same network with depthwise-separable convolutions, compare the cost of both
+        fast = ConvNN(neurons = 50, y_dim = 10, separable = True)
+        print(cnn.cost(), fast.cost())
+
+        # a deeper network with pooling and residual blocks
+        deep = ConvNN(neurons = None, y_dim = 10, spec = "conv:32:3:1:relu,bn,pool:2,res:64,pool:2,res:128,gap")
         
     """
 
 
     ## Defines instance variables 
     #
-    def __init__(self, neurons, y_dim, input_shape = (32, 32, 3), filters = 32, kernel_size = 3, strides = (2,2)):
+    def __init__(self, neurons, y_dim, input_shape = (32, 32, 3), filters = 32, kernel_size = 3, strides = (2,2), sparse = False, fused = False, logits = False,
+                 spec = None, separable = False):
 
         # calls the constructor method of NeuralNetwork class 
-        super().__init__(neurons = neurons, y_dim = y_dim)
+        super().__init__(neurons = None if spec else neurons, y_dim = y_dim, sparse = sparse, fused = fused, logits = logits)
         
         # calls hidden_layers() method to define self._hidden 
-        self.hidden_layers(neurons = neurons, input_shape = input_shape, filters = filters, kernel_size = kernel_size, strides = strides)
+        if spec:
+            self.spec_layers(spec, input_shape = input_shape)
+        else:
+            self.hidden_layers(neurons = neurons, input_shape = input_shape, filters = filters, kernel_size = kernel_size, strides = strides,
+                               separable = separable)
         
         # defines _params instance variable that is going to store
         # trainable_variables from hidden layer(s) and classification layer  
-        self._params = self._cls.trainable_variables + self._hidden.trainable_variables
+        self._finalize()
 
 
     ## Prints a short description of the class
@@ -292,8 +919,21 @@ class ConvNN(NeuralNetwork):
     #  @filters: int, the number of filters to be used in the first convolutional layer, and half the number of filters for the second convolutional layer
     #  @kernel_size: int, kernel size to be used in all three convolutional layers
     #  @strides: tuple, strides to be used in the first two convolutional layers
+    #  @separable: bool, uses depthwise-separable convolutions and global average pooling for the last two layers
     #
-    def hidden_layers(self, neurons, input_shape, filters, kernel_size, strides):
+    def hidden_layers(self, neurons, input_shape, filters, kernel_size, strides, separable = False):
+
+        # the first convolution sees only the 3 color channels, so a separable one would save little there,
+        # the following ones filter every channel on its own and mix the channels with a 1x1 convolution,
+        # the last one is averaged over all its positions instead of being computed at a single one
+        if separable:
+            self._hidden = Sequential([layers.InputLayer(input_shape = input_shape), 
+                                       layers.Conv2D(filters = filters, kernel_size = kernel_size, strides = strides), 
+                                       layers.SeparableConv2D(filters = 2 * filters, kernel_size = kernel_size, strides = strides), 
+                                       layers.SeparableConv2D(filters = neurons, kernel_size = kernel_size), 
+                                       layers.GlobalAveragePooling2D()])
+            return
+
         self._hidden = Sequential([layers.InputLayer(input_shape = input_shape), 
                                    layers.Conv2D(filters = filters, kernel_size = kernel_size, strides=strides), 
                                    layers.Conv2D(filters = 2 * filters, kernel_size = kernel_size, strides = strides), 
@@ -335,6 +975,25 @@ if __name__ == "__main__":
     assert fcnn._params[4].shape == (50, 50)
     assert fcnn._params[5].shape == (50,)
 
+    # the fused model has the same parameters in the same order and still outputs probabilities
+    fused = FullyConNN(neurons = 50, y_dim = 10, fused = True)
+    assert [p.shape for p in fused._params] == [p.shape for p in fcnn._params]
+    assert abs(float(tf.reduce_sum(fused.test(tf.zeros((1, 784))))) - 1) < 1e-5
+
+    # with logits the classification layer has no activation, test() still outputs probabilities
+    logit = FullyConNN(neurons = 50, y_dim = 10, logits = True)
+    assert logit._cls.layers[-1].activation is tf.keras.activations.linear
+    assert abs(float(tf.reduce_sum(logit.test(tf.zeros((1, 784))))) - 1) < 1e-5
+
+    # a spec replaces the hidden layers, the classification layer follows the width of the last one
+    deep = FullyConNN(neurons = None, y_dim = 10, spec = "dense:128:relu,bn,res:64,dense:32:relu")
+    assert deep._params[0].shape == (32, 10)
+    assert deep.cost()["flops"] > 2 * 784 * 128
+
+    # the estimate of the default network: two dense layers and the classification layer
+    assert fcnn.cost() == {"params": 784 * 50 + 50 + 50 * 50 + 50 + 50 * 10 + 10, 
+                           "flops": 2 * (784 * 50 + 50 * 50 + 50 * 10)}
+
     print("-" * 50)
 
 
@@ -363,3 +1022,8 @@ if __name__ == "__main__":
     # transformations inside the third convolutional layer 
     assert cnn._params[6].shape == (3, 3, 64, 50)
     assert cnn._params[7].shape == (50,)
+
+    # the separable variant needs about 2.8x fewer FLOPs
+    fast = ConvNN(neurons = 50, y_dim = 10, separable = True)
+    assert fast._params[0].shape == (50, 10)
+    assert 2.5 * fast.cost()["flops"] < cnn.cost()["flops"]
@@ -0,0 +1,249 @@
+## This file contains the ExportedModel and TFLiteModel classes, which load inference artifacts
+#  written by NeuralNetwork.export_artifact(), and the command line entry point that scores .npy files with them
+#  Neither the model classes nor the training code are imported, so that the cold start stays short
+#
+
+# for user-friendly usage from the command line
+import argparse
+import textwrap
+
+# for timing
+import time
+
+import numpy as np
+
+
+
+
+class ExportedModel:
+
+    """
+
+    A neural network exported as a SavedModel by NeuralNetwork.export_artifact()
+
+    Instance variables:
+
+        input_shape: tuple, the shape of one observation the model expects
+
+        While calling the constructor method the following parameters are expected:
+            @path: str, directory of the SavedModel
+
+    Public methods:
+
+        test(x)
+            Generates (pseudo)probabilities for provided observations
+            @x: array, features of observations (e.g. images), scaled to be between 0 and 1
+            @return pi_hat: array, predicted (pseudo)probabilities
+
+    Examples of usage:
+
+        # loads an exported model and scores a batch
+        m = ExportedModel("export/mnist")
+        pi_hat = m.test(x)
+
+    """
+
+    ## Loads the SavedModel
+    #  @path: str, directory of the SavedModel
+    #
+    def __init__(self, path):
+
+        # tensorflow is only imported if a SavedModel is used
+        import tensorflow as tf
+
+        self._loaded = tf.saved_model.load(path)
+        self._fn = self._loaded.signatures["serving_default"]
+        self._input_shape = tuple(self._fn.structured_input_signature[1]["x"].shape[1:])
+
+
+    ## Accessor for _input_shape
+    #
+    @property
+    def input_shape(self):
+        return self._input_shape
+
+
+    ## Generates (pseudo)probabilities for provided observations
+    #  @x: array, features of observations (e.g. images), scaled to be between 0 and 1
+    #  @return pi_hat: array, predicted (pseudo)probabilities
+    #
+    def test(self, x):
+        outputs = self._fn(x = np.asarray(x, dtype = np.float32))
+        return next(iter(outputs.values())).numpy()
+
+
+
+
+class TFLiteModel:
+
+    """
+
+    A neural network exported as a TFLite model by NeuralNetwork.export_artifact()
+
+    Instance variables:
+
+        input_shape: tuple, the shape of one observation the model expects
+
+        While calling the constructor method the following parameters are expected:
+            @model: str or bytes, path of the .tflite file or its content
+            @num_threads: int or None, number of threads of the interpreter, None lets the interpreter decide
+
+    Public methods:
+
+        test(x)
+            Generates (pseudo)probabilities for provided observations
+            @x: array, features of observations (e.g. images), scaled to be between 0 and 1
+            @return pi_hat: array, predicted (pseudo)probabilities
+
+    Examples of usage:
+
+        # loads an exported model and scores a batch
+        m = TFLiteModel("export/mnist.tflite")
+        pi_hat = m.test(x)
+
+        # a quantized model converted in memory, see quantize.py
+        m = TFLiteModel(model.to_tflite(quantize = "int8", calibration = x_cal))
+
+    """
+
+    ## Creates the interpreter, the lightweight tflite_runtime package is used if it is installed
+    #  @model: str or bytes, path of the .tflite file or its content
+    #  @num_threads: int or None, number of threads of the interpreter
+    #
+    def __init__(self, model, num_threads = None):
+
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+
+        if isinstance(model, bytes):
+            self._interpreter = Interpreter(model_content = model, num_threads = num_threads)
+        else:
+            self._interpreter = Interpreter(model_path = model, num_threads = num_threads)
+
+        self._input = self._interpreter.get_input_details()[0]
+        self._output = self._interpreter.get_output_details()[0]
+        self._input_shape = tuple(self._input["shape_signature"][1:])
+        self._batch_size = None
+
+
+    ## Accessor for _input_shape
+    #
+    @property
+    def input_shape(self):
+        return self._input_shape
+
+
+    ## Generates (pseudo)probabilities for provided observations
+    #  The interpreter is resized when the batch size changes, so batches of equal size are cheapest,
+    #  the input and output of fully integer quantized models are quantized and dequantized here
+    #  @x: array, features of observations (e.g. images), scaled to be between 0 and 1
+    #  @return pi_hat: array, predicted (pseudo)probabilities
+    #
+    def test(self, x):
+
+        x = np.asarray(x, dtype = np.float32)
+        if x.shape[0] != self._batch_size:
+            self._interpreter.resize_tensor_input(self._input["index"], x.shape)
+            self._interpreter.allocate_tensors()
+            self._batch_size = x.shape[0]
+
+        # real values are mapped to integers by x / scale + zero_point
+        if np.issubdtype(self._input["dtype"], np.integer):
+            scale, zero_point = self._input["quantization"]
+            info = np.iinfo(self._input["dtype"])
+            x = np.clip(np.round(x / scale + zero_point), info.min, info.max).astype(self._input["dtype"])
+
+        self._interpreter.set_tensor(self._input["index"], x)
+        self._interpreter.invoke()
+        pi_hat = self._interpreter.get_tensor(self._output["index"])
+
+        if np.issubdtype(self._output["dtype"], np.integer):
+            scale, zero_point = self._output["quantization"]
+            return (pi_hat.astype(np.float32) - zero_point) * scale
+
+        return pi_hat.copy()
+
+
+
+
+## Loads an inference artifact, .tflite files as TFLiteModel and directories as ExportedModel
+#  @path: str, path of the artifact
+#  @return ExportedModel or TFLiteModel
+#
+def load(path):
+    if path.endswith(".tflite"):
+        return TFLiteModel(path)
+    return ExportedModel(path)
+
+
+## Brings images into the shape and scale the model expects
+#  uint8 images are scaled to be between 0 and 1 like in DataLoader.preprocess()
+#  @x: array, a batch of images
+#  @input_shape: tuple, the shape of one observation the model expects
+#  @return array of float32
+#
+def prepare(x, input_shape):
+    x = np.asarray(x)
+    if x.dtype == np.uint8:
+        x = x / 255
+    return x.astype(np.float32).reshape((x.shape[0],) + tuple(input_shape))
+
+
+## Scores all observations of an array in batches and writes the predictions into a preallocated array
+#  @model: ExportedModel or TFLiteModel
+#  @x: array, e.g. memory-mapped, images to be scored
+#  @out: array, preallocated array for the predictions, or None to allocate it once the output shape is known
+#  @batch_size: int, number of images per batch
+#  @return a tuple (out, latencies) with the predictions and the latency of every batch in seconds
+#
+def predict(model, x, out = None, batch_size = 4096):
+
+    latencies = []
+    for start in range(0, x.shape[0], batch_size):
+        batch = prepare(x[start:start + batch_size], model.input_shape)
+
+        begin = time.perf_counter()
+        pi_hat = model.test(batch)
+        latencies.append(time.perf_counter() - begin)
+
+        if out is None:
+            out = np.empty((x.shape[0],) + pi_hat.shape[1:], dtype = pi_hat.dtype)
+        out[start:start + pi_hat.shape[0]] = pi_hat
+
+    return out, latencies
+
+
+
+
+if __name__ == "__main__":
+
+    # define parser
+    parser = argparse.ArgumentParser(description =
+                                     textwrap.dedent("""Scores images stored in a .npy file with a model exported by train.py."""),
+                                     epilog =
+                                     textwrap.dedent("""This code may be run by using the following commands:
+    python3 predict.py --model export/mnist --input x.npy --output pi_hat.npy
+    python3 predict.py --model export/cifar10.tflite --input x.npy --output pi_hat.npy --batch_size 1024"""),
+                                     formatter_class = argparse.RawTextHelpFormatter)
+
+    parser.add_argument("--model", required = True, help = "SavedModel directory or .tflite file written by train.py --export")
+    parser.add_argument("--input", required = True, help = ".npy file with images, uint8 images are scaled to be between 0 and 1")
+    parser.add_argument("--output", required = True, help = ".npy file the predicted (pseudo)probabilities are written to")
+    parser.add_argument("--batch_size", default = 4096, type = int, help = "Number of images per batch")
+
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    model = load(args.model)
+    load_time = time.perf_counter() - start
+
+    # the input is memory-mapped, only one batch is in memory at a time
+    x = np.load(args.input, mmap_mode = "r")
+    out, latencies = predict(model, x, batch_size = args.batch_size)
+    np.save(args.output, out)
+
+    print(f"loaded model in {load_time * 1e3:.1f} ms, scored {x.shape[0]} images in {len(latencies)} batches, "
+          f"median batch latency {np.median(latencies) * 1e3:.2f} ms, {x.shape[0] / sum(latencies):.0f} images/s")
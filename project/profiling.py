@@ -0,0 +1,246 @@
+## This file contains the Profiler class, which instruments the training loop of train.py
+#  with per-phase timers, TensorBoard trace windows and scalar summaries,
+#  and the NullProfiler class, which has the same methods and does nothing, so that disabled profiling costs nearly nothing
+#
+
+# for timing
+import collections
+import contextlib
+import time
+
+import tensorflow as tf
+
+
+
+
+class Profiler:
+
+    """
+
+    Instruments a training loop: times its phases, records TensorBoard traces over a window of steps
+    and writes loss, throughput and the fraction of time spent waiting for input as scalar summaries
+
+    Phases may be nested, e.g. the "forward", "gradient" and "apply" phases reported by an eagerly running
+    NeuralNetwork are part of the "step" phase, and a compiled step only reports the "step" phase as a whole
+
+    Instance variables:
+
+        While calling the constructor method the following parameters are expected:
+            @log_dir: str, directory of the TensorBoard traces and summaries
+            @trace_steps: tuple (start, stop) or None, steps [start, stop) recorded with tf.profiler, None records no trace
+            @summary_every: int, number of steps between scalar summaries, by default 100
+
+    Public methods:
+
+        begin(step)
+            Starts or stops the trace window, called before every step
+            @step: int, the global step about to run
+
+        phase(name)
+            Context manager adding the time spent inside of it to the phase
+            @name: str, the name of the phase, e.g. "input" or "step"
+
+        wait(x)
+            Waits until the tensors of x are computed, so that asynchronous work is timed in the enclosing phase
+            @x: tensor or nested structure of tensors
+            @return x
+
+        end(batch_size, steps = 1, loss = None)
+            Counts finished steps and writes the scalar summaries every summary_every steps
+            @batch_size: int, number of images of one step
+            @steps: int, number of steps finished since begin()
+            @loss: callable or None, returns the (mean, last) loss, e.g. NeuralNetwork.running_loss, 
+                   it is only called when summaries are written, so the loss stays on the device otherwise
+
+        close()
+            Stops an open trace and flushes the summaries
+            @return dict with the total seconds of every phase, the number of steps and the input-wait fraction
+
+    Examples of usage:
+
+        profiler = Profiler("logs/run", trace_steps = (10, 20))
+        iterator = iter(tr_data)
+        while True:
+            profiler.begin(step)
+            with profiler.phase("input"):
+                batch = next(iterator, None)
+            if batch is None:
+                break
+            with profiler.phase("step"):
+                profiler.wait(model.train(batch, optimizer))
+            profiler.end(batch_size = 256, loss = model.running_loss)
+            step += 1
+        print(profiler.close())
+
+    """
+
+    ## Constructs an object and creates the summary writer
+    #
+    def __init__(self, log_dir, trace_steps = None, summary_every = 100):
+        self._log_dir = log_dir
+        self._trace_steps = trace_steps
+        self._summary_every = summary_every
+        self._writer = tf.summary.create_file_writer(log_dir)
+        self._tracing = False
+
+        self._step = 0
+        self._totals = collections.defaultdict(float)
+
+        # the phases, images and loss since the last summary
+        self._interval = collections.defaultdict(float)
+        self._images = 0
+        self._interval_start = time.perf_counter()
+        self._summary_step = 0
+
+
+    ## Starts or stops the trace window, called before every step
+    #  @step: int, the global step about to run
+    #
+    def begin(self, step):
+        self._step = step
+        if self._trace_steps is None:
+            return
+
+        start, stop = self._trace_steps
+        if not self._tracing and start <= step < stop:
+            tf.profiler.experimental.start(self._log_dir)
+            self._tracing = True
+        elif self._tracing and step >= stop:
+            tf.profiler.experimental.stop()
+            self._tracing = False
+
+
+    ## Adds the time spent inside of the context to the phase
+    #  Inside of the trace window the phase is also annotated in the trace, the "step" phase as a training step
+    #  @name: str, the name of the phase
+    #
+    @contextlib.contextmanager
+    def phase(self, name):
+
+        if not self._tracing:
+            annotation = contextlib.nullcontext()
+        elif name == "step":
+            annotation = tf.profiler.experimental.Trace("train", step_num = self._step, _r = 1)
+        else:
+            annotation = tf.profiler.experimental.Trace(name)
+
+        start = time.perf_counter()
+        try:
+            with annotation:
+                yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self._totals[name] += elapsed
+            self._interval[name] += elapsed
+
+
+    ## Waits until the tensors of x are computed
+    #  @x: tensor or nested structure of tensors
+    #  @return x
+    #
+    def wait(self, x):
+        for tensor in tf.nest.flatten(x):
+            if hasattr(tensor, "numpy"):
+                tensor.numpy()
+        return x
+
+
+    ## Counts finished steps and writes the scalar summaries every summary_every steps
+    #  @batch_size: int, number of images of one step
+    #  @steps: int, number of steps finished since begin()
+    #  @loss: callable or None, returns the (mean, last) loss, only called when summaries are written
+    #
+    def end(self, batch_size, steps = 1, loss = None):
+
+        self._totals["steps"] += steps
+        self._images += batch_size * steps
+        step = self._step + steps
+        if step - self._summary_step < self._summary_every:
+            return
+
+        elapsed = time.perf_counter() - self._interval_start
+        busy = self._interval["input"] + self._interval["step"]
+        with self._writer.as_default():
+            if loss is not None:
+                mean, last = loss()
+                tf.summary.scalar("loss/mean", mean, step = step)
+                tf.summary.scalar("loss/last", last, step = step)
+            tf.summary.scalar("images_per_sec", self._images / elapsed, step = step)
+            tf.summary.scalar("input_wait_fraction", self._interval["input"] / busy if busy > 0 else 0.0, step = step)
+
+        self._summary_step = step
+        self._interval.clear()
+        self._images = 0
+        self._interval_start = time.perf_counter()
+
+
+    ## Stops an open trace and flushes the summaries
+    #  @return dict with the total seconds of every phase, the number of steps and the input-wait fraction
+    #
+    def close(self):
+
+        if self._tracing:
+            tf.profiler.experimental.stop()
+            self._tracing = False
+        self._writer.flush()
+
+        totals = dict(self._totals)
+        busy = totals.get("input", 0.0) + totals.get("step", 0.0)
+        totals["input_wait_fraction"] = totals.get("input", 0.0) / busy if busy > 0 else 0.0
+
+        return totals
+
+
+
+
+class NullProfiler:
+
+    """
+
+    Profiler with the methods of Profiler that measures nothing, used when profiling is disabled
+
+    Public methods:
+
+        All public methods are the same as in the class Profiler, close() returns None
+
+    """
+
+    # a single reusable context, so that a disabled phase allocates nothing
+    _phase = contextlib.nullcontext()
+
+    ## Does nothing
+    #  @step: int, the global step about to run
+    #
+    def begin(self, step):
+        pass
+
+
+    ## Returns a context that measures nothing
+    #  @name: str, the name of the phase
+    #
+    def phase(self, name):
+        return self._phase
+
+
+    ## Returns x without waiting for its tensors, so that disabled profiling does not synchronize
+    #  @x: tensor or nested structure of tensors
+    #  @return x
+    #
+    def wait(self, x):
+        return x
+
+
+    ## Does nothing, the loss is never read
+    #  @batch_size: int, number of images of one step
+    #  @steps: int, number of steps finished since begin()
+    #  @loss: callable or None
+    #
+    def end(self, batch_size, steps = 1, loss = None):
+        pass
+
+
+    ## Nothing was measured
+    #  @return None
+    #
+    def close(self):
+        return None
@@ -0,0 +1,104 @@
+## This file contains the post-training quantization of trained neural networks into int8 TFLite models
+#  and the comparison of their AUC and speed on the test subset with the float32 model
+#
+
+# for timing
+import time
+
+import numpy as np
+
+# for running the quantized models and bringing images into shape
+from predict import TFLiteModel, prepare
+
+# for performance analysis
+from evaluation import score
+
+
+
+
+## Draws a calibration sample from the training subset
+#  @data_loader: DataLoader
+#  @input_shape: tuple, the shape of one observation the model expects
+#  @size: int, number of observations, by default 500
+#  @seed: int, seed of the sample, by default 0
+#  @return array of float32, observations scaled to be between 0 and 1
+#
+def calibration_sample(data_loader, input_shape, size = 500, seed = 0):
+
+    # only the sampled observations are gathered, uint8 images of lazy loaders are scaled by prepare()
+    idx = np.random.default_rng(seed).choice(data_loader.n_tr, size = min(size, data_loader.n_tr), replace = False)
+    x, _ = data_loader.take(np.sort(idx))
+
+    return prepare(x, input_shape)
+
+
+## Converts a trained neural network into a quantized TFLite model
+#  @model: NeuralNetwork, a trained neural network
+#  @data_loader: DataLoader, the calibration sample is drawn from its training subset
+#  @mode: str or None, "dynamic" for int8 weights, "int8" for int8 weights, activations, input and output, None for float32
+#  @size: int, number of calibration observations, only used by "int8"
+#  @seed: int, seed of the calibration sample
+#  @return bytes, the content of the .tflite file
+#
+def convert(model, data_loader, mode = "int8", size = 500, seed = 0):
+
+    calibration = None
+    if mode == "int8":
+        calibration = calibration_sample(data_loader, model.sample_shape, size = size, seed = seed)
+
+    return model.to_tflite(quantize = mode, calibration = calibration)
+
+
+## Quantizes a trained neural network into a TFLite model
+#  @model, @data_loader, @mode, @size, @seed: the same as in convert()
+#  @num_threads: int or None, number of threads of the interpreter
+#  @return TFLiteModel, with the same test() as the model
+#
+def quantize(model, data_loader, mode = "int8", size = 500, seed = 0, num_threads = None):
+    return TFLiteModel(convert(model, data_loader, mode = mode, size = size, seed = seed), num_threads = num_threads)
+
+
+## Compares quantized models with the float32 TFLite model of a trained neural network on the test subset
+#  The test subset is scored batch by batch from DataLoader.test_loader(), so it is never held in memory as a whole
+#  @model: NeuralNetwork, a trained neural network
+#  @data_loader: DataLoader, with the training subset for calibration and the test subset for the comparison
+#  @modes: tuple of str, quantization modes to compare, see convert()
+#  @batch_size: int, number of images per batch
+#  @size: int, number of calibration observations
+#  @num_threads: int or None, number of threads of the interpreters
+#  @return a tuple (results, contents), results is a dict with the AUC, the seconds spent in test() on the test subset 
+#          and the size in bytes of "float32" and every mode, the modes additionally with the AUC delta and the speedup 
+#          relative to "float32", contents is a dict with the content of the .tflite file of every mode
+#
+def compare(model, data_loader, modes = ("dynamic", "int8"), batch_size = 1024, size = 500, num_threads = None):
+
+    te_data = data_loader.test_loader(batch_size = batch_size)
+
+    results, contents = {}, {}
+    for mode in (None,) + tuple(modes):
+        content = convert(model, data_loader, mode = mode, size = size)
+        tflite = TFLiteModel(content, num_threads = num_threads)
+
+        # the first batch allocates the tensors of the interpreter and is not timed
+        x, _ = next(iter(te_data))
+        tflite.test(prepare(x.numpy(), tflite.input_shape))
+
+        # only test() is timed, not the input pipeline
+        pi_hat, y_true, seconds = [], [], 0.0
+        for x, y in te_data:
+            x = prepare(x.numpy(), tflite.input_shape)
+            start = time.perf_counter()
+            pi_hat.append(tflite.test(x))
+            seconds += time.perf_counter() - start
+            y_true.append(y.numpy())
+
+        name = mode or "float32"
+        auc = score(np.concatenate(y_true), np.concatenate(pi_hat))
+        results[name] = {"auc": float(auc), "seconds": seconds, "bytes": len(content)}
+        contents[name] = content
+
+    for mode in modes:
+        results[mode]["auc_delta"] = results[mode]["auc"] - results["float32"]["auc"]
+        results[mode]["speedup"] = results["float32"]["seconds"] / results[mode]["seconds"]
+
+    return results, contents
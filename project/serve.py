@@ -0,0 +1,363 @@
+## This file contains the Batcher class, which coalesces concurrent prediction requests into batches,
+#  and a minimal asyncio HTTP server around it, listening on localhost or on a Unix socket
+#
+#  POST /predict expects a .npy file with a batch of images as body and answers with a .npy file
+#  with their (pseudo)probabilities, GET /stats answers with latency percentiles and throughput as JSON
+#
+
+# for user-friendly usage from the command line
+import argparse
+import textwrap
+
+# for the server
+import asyncio
+import collections
+import io
+import json
+import time
+
+import numpy as np
+
+# for loading exported models and bringing requests into shape
+from predict import load, prepare
+
+
+
+
+class Batcher:
+
+    """
+
+    Coalesces concurrent prediction requests into batches, so that one test() call serves many requests
+
+    A batch is run once it holds max_batch_size observations or once its first request has
+    waited max_wait_ms, whichever comes first, results are scattered back to the requests
+    Batches are padded to max_batch_size, so that the model always sees the same batch shape
+    and e.g. a TFLite interpreter does not reallocate its tensors for every batch
+
+    Instance variables:
+
+        While calling the constructor method the following parameters are expected:
+            @model: object with a test(x) method and an input_shape, e.g. ExportedModel or TFLiteModel
+            @max_batch_size: int, maximum number of observations in one batch, by default 256
+            @max_wait_ms: float, maximum time the first request of a batch waits for others, by default 5
+
+    Public methods:
+
+        predict(x)
+            Coroutine, queues a request and waits for its (pseudo)probabilities
+            @x: array, one or more observations
+            @return pi_hat: array, predicted (pseudo)probabilities
+
+        run()
+            Coroutine, forms and runs batches until it is cancelled
+
+        stats()
+            Latency percentiles of requests, throughput and mean batch size since the start
+            @return dict
+
+    Examples of usage:
+
+        # inside a running event loop
+        batcher = Batcher(load("export/mnist.tflite"), max_batch_size = 512)
+        asyncio.create_task(batcher.run())
+        pi_hat = await batcher.predict(x)
+
+    """
+
+    ## Constructs an object with an empty queue
+    #
+    def __init__(self, model, max_batch_size = 256, max_wait_ms = 5):
+        self._model = model
+        self._max_batch_size = max_batch_size
+        self._max_wait = max_wait_ms / 1e3
+        self._queue = asyncio.Queue()
+
+        # the latencies of the latest requests are kept for the percentiles
+        self._latencies = collections.deque(maxlen = 100000)
+        self._observations = 0
+        self._batches = 0
+        self._start = time.perf_counter()
+
+
+    ## Queues a request and waits for its (pseudo)probabilities
+    #  @x: array, one or more observations
+    #  @return pi_hat: array, predicted (pseudo)probabilities
+    #
+    async def predict(self, x):
+        x = prepare(x, self._model.input_shape)
+        future = asyncio.get_running_loop().create_future()
+        start = time.perf_counter()
+
+        await self._queue.put((x, future))
+        pi_hat = await future
+
+        self._latencies.append(time.perf_counter() - start)
+        return pi_hat
+
+
+    ## Forms and runs batches until it is cancelled
+    #  test() runs in a worker thread, so that requests keep being accepted while a batch runs
+    #
+    async def run(self):
+
+        loop = asyncio.get_running_loop()
+        while True:
+
+            # the first request opens a batch, further requests join until the batch is full or the wait is over
+            requests = [await self._queue.get()]
+            size = requests[0][0].shape[0]
+            deadline = loop.time() + self._max_wait
+            while size < self._max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    request = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                requests.append(request)
+                size += request[0].shape[0]
+
+            batch = np.concatenate([x for x, _ in requests])
+            try:
+                pi_hat = await loop.run_in_executor(None, self._test, batch)
+
+            # failures of the model are reported as RuntimeError, so that they are not mistaken for bad requests
+            except Exception as e:
+                error = RuntimeError(f"{type(e).__name__}: {e}")
+                for _, future in requests:
+                    if not future.cancelled():
+                        future.set_exception(error)
+                continue
+
+            # scatters the rows of the batch back to the requests
+            start = 0
+            for x, future in requests:
+                if not future.cancelled():
+                    future.set_result(pi_hat[start:start + x.shape[0]])
+                start += x.shape[0]
+
+            self._observations += batch.shape[0]
+            self._batches += 1
+
+
+    ## Runs the model on a batch padded to a multiple of max_batch_size, one max_batch_size chunk at a time
+    #  @batch: array, the observations of the coalesced requests
+    #  @return pi_hat: array, predicted (pseudo)probabilities of the observations without the padding
+    #
+    def _test(self, batch):
+        n = batch.shape[0]
+        size = self._max_batch_size
+        padded = np.zeros((-(-n // size) * size,) + batch.shape[1:], dtype = batch.dtype)
+        padded[:n] = batch
+        return np.concatenate([self._model.test(padded[start:start + size]) for start in range(0, padded.shape[0], size)])[:n]
+
+
+    ## Latency percentiles of requests, throughput and mean batch size since the start
+    #  @return dict
+    #
+    def stats(self):
+        latencies = np.asarray(self._latencies) if self._latencies else np.zeros(1)
+        elapsed = time.perf_counter() - self._start
+        return {"requests": len(self._latencies),
+                "p50_ms": float(np.percentile(latencies, 50) * 1e3),
+                "p99_ms": float(np.percentile(latencies, 99) * 1e3),
+                "observations_per_sec": self._observations / elapsed,
+                "mean_batch_size": self._observations / max(self._batches, 1)}
+
+
+
+
+## Writes one HTTP response
+#  @writer: asyncio stream of the connection
+#  @status, @content_type: str, status line and content type of the response
+#  @payload: bytes, body of the response
+#
+async def respond(writer, status, content_type, payload):
+    writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(payload)}\r\n\r\n".encode() + payload)
+    await writer.drain()
+
+
+## Serves one connection, requests on the same connection are answered in order (HTTP/1.1 keep-alive)
+#  Every request is answered, bodies that cannot be decoded or reshaped with 400 and failures of the model with 500
+#  @batcher: Batcher
+#  @reader, @writer: asyncio streams of the connection
+#
+async def handle(batcher, reader, writer):
+
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+
+            # only Content-Length is needed from the headers
+            try:
+                method, path, _ = request_line.decode().split(" ", 2)
+                length = 0
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode().partition(":")
+                    if name.strip().lower() == "content-length":
+                        length = int(value)
+
+            # the end of a malformed request is unknown, so the connection is closed after answering it
+            except ValueError:
+                await respond(writer, "400 Bad Request", "text/plain", b"malformed request")
+                break
+
+            body = await reader.readexactly(length) if length else b""
+
+            if method == "POST" and path == "/predict":
+                try:
+                    pi_hat = await batcher.predict(np.load(io.BytesIO(body), allow_pickle = False))
+                    out = io.BytesIO()
+                    np.save(out, pi_hat)
+                    status, content_type, payload = "200 OK", "application/octet-stream", out.getvalue()
+
+                # empty, truncated or undecodable bodies and observations of the wrong shape
+                except (ValueError, EOFError, OSError) as e:
+                    status, content_type, payload = "400 Bad Request", "text/plain", str(e).encode()
+                except Exception as e:
+                    status, content_type, payload = "500 Internal Server Error", "text/plain", str(e).encode()
+
+            elif method == "GET" and path == "/stats":
+                status, content_type, payload = "200 OK", "application/json", json.dumps(batcher.stats()).encode()
+
+            else:
+                status, content_type, payload = "404 Not Found", "text/plain", b"not found"
+
+            await respond(writer, status, content_type, payload)
+
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+
+    finally:
+        writer.close()
+
+
+## Starts the batcher and the server and serves until interrupted
+#  @batcher: Batcher
+#  @host, @port: str and int, address the server listens on if no socket is provided
+#  @socket: str or None, path of a Unix socket the server listens on instead
+#
+async def serve(batcher, host = "127.0.0.1", port = 8080, socket = None):
+
+    worker = asyncio.create_task(batcher.run())
+    callback = lambda reader, writer: handle(batcher, reader, writer)
+
+    if socket is not None:
+        server = await asyncio.start_unix_server(callback, path = socket)
+    else:
+        server = await asyncio.start_server(callback, host = host, port = port)
+
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        worker.cancel()
+        print(json.dumps(batcher.stats()))
+
+
+## Checks the coalescing, the padding and the scattering of the Batcher and the responses of handle() 
+#  with a stub model, without tensorflow or an exported model
+#
+async def self_test():
+
+    class Stub:
+        input_shape = (2,)
+        sizes = []
+        fail = False
+        def test(self, x):
+            if self.fail:
+                raise RuntimeError("model failed")
+            self.sizes.append(x.shape[0])
+            return x * 2
+
+    model = Stub()
+    batcher = Batcher(model, max_batch_size = 8, max_wait_ms = 50)
+    worker = asyncio.create_task(batcher.run())
+
+    # concurrent requests are coalesced into one batch padded to max_batch_size, every request gets its own rows back
+    xs = [np.full((k, 2), k, dtype = np.float32) for k in (1, 2, 3)]
+    results = await asyncio.gather(*(batcher.predict(x) for x in xs))
+    assert model.sizes == [8]
+    for x, pi_hat in zip(xs, results):
+        assert pi_hat.shape == x.shape and (pi_hat == 2 * x).all()
+
+    # a request larger than max_batch_size is run in chunks of max_batch_size
+    model.sizes.clear()
+    x = np.arange(40, dtype = np.float32).reshape((20, 2))
+    assert (await batcher.predict(x) == 2 * x).all()
+    assert model.sizes == [8, 8, 8]
+
+    # every request is answered, also malformed ones and those the model fails on
+    server = await asyncio.start_server(lambda reader, writer: handle(batcher, reader, writer), host = "127.0.0.1", port = 0)
+    port = server.sockets[0].getsockname()[1]
+
+    async def status(request):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(request)
+        line = await reader.readline()
+        writer.close()
+        return line.split(b" ")[1]
+
+    out = io.BytesIO()
+    np.save(out, np.ones((3, 2), dtype = np.float32))
+    good = b"POST /predict HTTP/1.1\r\nContent-Length: %d\r\n\r\n" % len(out.getvalue()) + out.getvalue()
+
+    assert await status(good) == b"200"
+    assert await status(b"garbage\r\n\r\n") == b"400"
+    assert await status(b"POST /predict HTTP/1.1\r\nContent-Length: 0\r\n\r\n") == b"400"
+    assert await status(b"POST /predict HTTP/1.1\r\nContent-Length: 4\r\n\r\nnope") == b"400"
+    model.fail = True
+    assert await status(good) == b"500"
+
+    server.close()
+    worker.cancel()
+    print("serve.py self-test passed")
+
+
+
+
+if __name__ == "__main__":
+
+    # define parser
+    parser = argparse.ArgumentParser(description =
+                                     textwrap.dedent("""Serves a model exported by train.py, coalescing concurrent requests into batches."""),
+                                     epilog =
+                                     textwrap.dedent("""This code may be run by using the following commands:
+    python3 serve.py --model export/mnist --port 8080 --max_batch_size 512 --max_wait_ms 2
+    python3 serve.py --model export/cifar10.tflite --socket /tmp/cifar10.sock
+    python3 serve.py --self_test
+
+Requests:
+    curl --data-binary @x.npy http://127.0.0.1:8080/predict -o pi_hat.npy
+    curl http://127.0.0.1:8080/stats"""),
+                                     formatter_class = argparse.RawTextHelpFormatter)
+
+    parser.add_argument("--model", default = None, help = "SavedModel directory or .tflite file written by train.py --export")
+    parser.add_argument("--host", default = "127.0.0.1", help = "Address the server listens on")
+    parser.add_argument("--port", default = 8080, type = int, help = "Port the server listens on")
+    parser.add_argument("--socket", default = None, help = "Unix socket the server listens on instead of host and port")
+    parser.add_argument("--max_batch_size", default = 256, type = int, help = "Maximum number of observations in one batch")
+    parser.add_argument("--max_wait_ms", default = 5, type = float, help = "Maximum time a request waits for others to join its batch")
+
+    # checks the batcher and the handler with a stub model instead of serving
+    parser.add_argument("--self_test", action = "store_true", help = "Run the self-test of the batcher and the handler and exit")
+
+    args = parser.parse_args()
+    if args.self_test:
+        asyncio.run(self_test())
+        raise SystemExit
+    if args.model is None:
+        parser.error("--model is required")
+
+    batcher = Batcher(load(args.model), max_batch_size = args.max_batch_size, max_wait_ms = args.max_wait_ms)
+    try:
+        asyncio.run(serve(batcher, host = args.host, port = args.port, socket = args.socket))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,189 @@
+## This file contains the sweep runner, which trains one model per configuration of a grid of hyperparameters
+#  in a pool of worker processes and collects the results into one table
+#  The dataset is loaded and preprocessed once and shared with the workers through shared memory,
+#  every worker is pinned to its own cores and runs TensorFlow with as many intra-op threads
+#
+#  Tip: try to run it in the command line with the --help flag to see all options
+#
+
+# for user-friendly usage from the command line
+import argparse
+import textwrap
+
+# for the process pool
+import concurrent.futures
+import itertools
+import json
+import multiprocessing
+import os
+import time
+
+import tensorflow as tf
+
+# importing the dataloaders
+from dataloaders import MNIST, CIFAR10, Shared
+
+# for training and evaluating one configuration
+from train import train
+
+
+# set by the initializer of every worker process
+_data_loader = None
+
+
+
+
+## Cores the current process may run on
+#  @return list of int
+#
+def available_cores():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+## Initializes a worker process: pins it to its cores, limits TensorFlow's thread pools
+#  and attaches to the shared dataset
+#  @spec: dict, the description of the shared memory blocks returned by DataLoader.to_shared_memory()
+#  @cores: multiprocessing queue of lists of cores, every worker takes one list
+#
+def init_worker(spec, cores):
+
+    global _data_loader
+
+    # the thread pools are configured before the first op creates them
+    pinned = cores.get()
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, pinned)
+
+    tf.config.threading.set_intra_op_parallelism_threads(len(pinned))
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+    _data_loader = Shared(spec)
+
+
+## Trains and evaluates one configuration in a worker process
+#  @config: dict, the hyperparameters of the configuration (nn_type, neurons, batch_size, epochs)
+#  @kwargs: dict, further arguments of train() shared by all configurations
+#  @return dict with the configuration and the results of train(), or the error if training failed
+#
+def run(config, kwargs):
+
+    start = time.perf_counter()
+    try:
+        results = train(dset = _data_loader, verbose = False, **config, **kwargs)
+    except Exception as e:
+        results = {"error": f"{type(e).__name__}: {e}"}
+
+    return dict(config, **results, wall = time.perf_counter() - start)
+
+
+## Trains every configuration of a grid in a pool of worker processes
+#  @data_loader: DataLoader, the dataset, which is copied into shared memory once
+#  @grid: dict, lists of values of the hyperparameters, every combination is one configuration
+#  @workers: int or None, number of worker processes, None uses one worker per threads cores
+#  @threads: int, number of cores and intra-op threads of every worker
+#  @kwargs: further arguments of train() shared by all configurations
+#  @return list of dicts, the results of run() in the order of the grid
+#
+def sweep(data_loader, grid, workers = None, threads = 1, **kwargs):
+
+    cores = available_cores()
+    if workers is None:
+        workers = max(len(cores) // threads, 1)
+
+    configs = [dict(zip(grid, values)) for values in itertools.product(*grid.values())]
+    workers = min(workers, len(configs))
+
+    # TensorFlow is not fork-safe, workers are spawned and only receive the names of the shared memory blocks
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    for i in range(workers):
+        queue.put([cores[(i * threads + j) % len(cores)] for j in range(threads)])
+
+    spec, blocks = data_loader.to_shared_memory()
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers = workers, mp_context = context,
+                                                    initializer = init_worker, initargs = (spec, queue)) as pool:
+            futures = [pool.submit(run, config, kwargs) for config in configs]
+            return [future.result() for future in futures]
+
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+
+## Formats the results of a sweep as a table with one row per configuration
+#  @results: list of dicts, returned by sweep()
+#  @return str
+#
+def table(results):
+
+    header = (f"{'nn_type':>9} {'neurons':>8} {'batch_size':>10} {'epochs':>6} {'trained':>7} {'val_auc':>7} {'auc':>7} "
+              f"{'train_s':>8} {'steps/s':>8} {'wall_s':>7}")
+    rows = [header, "-" * len(header)]
+    for r in results:
+        row = f"{r['nn_type']:>9} {r['neurons']:>8} {r['batch_size']:>10} {r['epochs']:>6} "
+        if "error" in r:
+            row += r["error"]
+        else:
+            val_auc = "-" if r["val_auc"] is None else f"{r['val_auc']:.4f}"
+            row += (f"{r['epochs_trained']:>7} {val_auc:>7} {r['auc']:>7.4f} "
+                    f"{r['seconds']:>8.1f} {r['steps_per_sec']:>8.1f} {r['wall']:>7.1f}")
+        rows.append(row)
+
+    return "\n".join(rows)
+
+
+
+
+if __name__ == "__main__":
+
+    # define parser
+    parser = argparse.ArgumentParser(description =
+                                     textwrap.dedent("""Trains one model per configuration of a grid of hyperparameters in parallel worker processes."""),
+                                     epilog =
+                                     textwrap.dedent("""This code may be run by using the following commands:
+    python3 sweep.py --dset mnist --neurons 50 100 200 --batch_size 128 256 --epochs 5
+    python3 sweep.py --dset cifar10 --nn_type conv --neurons 32 64 --threads 2 --output sweep.json"""),
+                                     formatter_class = argparse.RawTextHelpFormatter)
+
+    parser.add_argument("--dset", choices = ["mnist", "cifar10"], default = "mnist", help = "Dataset for model training and testing")
+    parser.add_argument("--nn_type", nargs = "+", choices = ["fully_con", "conv"], default = None,
+                        help = "Neural network architectures, by default the one matching the dataset")
+    parser.add_argument("--neurons", nargs = "+", default = [50], type = int, help = "Numbers of neurons to be used")
+    parser.add_argument("--batch_size", nargs = "+", default = [256], type = int, help = "Numbers of images per batch")
+    parser.add_argument("--epochs", nargs = "+", default = [10], type = int, help = "Numbers of epochs")
+    parser.add_argument("--workers", default = None, type = int, help = "Number of worker processes, by default one per --threads cores")
+    parser.add_argument("--threads", default = 1, type = int, help = "Number of cores and intra-op threads of every worker")
+    parser.add_argument("--lazy", action = "store_true", help = "Share the images as uint8, which needs a quarter of the memory")
+    parser.add_argument("--sparse", action = "store_true", help = "Share the labels as class indices")
+    parser.add_argument("--cache_dir", default = None, help = "Directory in which the preprocessed dataset is cached between runs")
+    parser.add_argument("--validation", default = 0.0, type = float, help = "Share of the training images used for validation after every epoch")
+    parser.add_argument("--patience", default = None, type = int, help = "Stop a configuration after this many epochs without improvement of the validation AUC")
+    parser.add_argument("--seed", default = None, type = int, help = "Seed of the shuffling and the augmentation, the same for all configurations")
+    parser.add_argument("--output", default = None, help = "Path of the JSON file the results are written to")
+
+    args = parser.parse_args()
+    if args.nn_type is None:
+        args.nn_type = ["fully_con" if args.dset == "mnist" else "conv"]
+
+    if args.dset == "mnist":
+        data_loader = MNIST(lazy = args.lazy, cache_dir = args.cache_dir, sparse = args.sparse)
+    else:
+        data_loader = CIFAR10(lazy = args.lazy, cache_dir = args.cache_dir, sparse = args.sparse)
+
+    grid = {"nn_type": args.nn_type, "neurons": args.neurons, "batch_size": args.batch_size, "epochs": args.epochs}
+
+    start = time.perf_counter()
+    results = sweep(data_loader, grid, workers = args.workers, threads = args.threads, seed = args.seed,
+                    validation = args.validation, patience = args.patience)
+    total = time.perf_counter() - start
+
+    print(table(results))
+    print(f"\n{len(results)} configurations in {total:.1f} s")
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump({"config": vars(args), "seconds": total, "results": results}, f, indent = 2)
@@ -12,79 +12,395 @@ import textwrap
 from models import FullyConNN, ConvNN
 
 # importing the dataloaders
-from dataloaders import MNIST, CIFAR10
+from dataloaders import DataLoader, MNIST, CIFAR10, Synthetic, Sharded
 
 # for training
 import tensorflow as tf
 
+# for drawing a shuffle seed that is stored in checkpoints
+import random
+
+# for measuring training time
+import time
+
 # for performance analysis
-from sklearn.metrics import roc_auc_score
+from evaluation import evaluate
+from profiling import Profiler, NullProfiler
+
+# for post-training quantization
+import quantize as ptq
+
+
+## Creates a MirroredStrategy over logical CPU devices, one per replica
+#  The single physical CPU is split into logical devices, which only works before tensorflow initializes its devices
+#  @replicas: int, number of replicas
+#  @return strategy: tf.distribute.MirroredStrategy
+#
+def cpu_strategy(replicas):
+
+    cpu = tf.config.list_physical_devices("CPU")[0]
+    try:
+        tf.config.set_logical_device_configuration(cpu, [tf.config.LogicalDeviceConfiguration() for _ in range(replicas)])
+    
+    # devices were already initialized, e.g. by an earlier call, the existing logical devices are used
+    except RuntimeError:
+        pass
+
+    devices = [device.name for device in tf.config.list_logical_devices("CPU")][:replicas]
+    if len(devices) < replicas:
+        raise ValueError(f"only {len(devices)} logical CPU devices are available, restart the process to use {replicas} replicas")
+
+    # NCCL all-reduce is GPU only, CPU replicas reduce their gradients on one device
+    return tf.distribute.MirroredStrategy(devices = devices, cross_device_ops = tf.distribute.ReductionToOneDevice())
 
 
 ## Trains the model and prints out AUC metric of model performance on the testing subset
+#  @dset: str, "mnist", "cifar10", "synthetic_mnist" and "synthetic_cifar10" for generated images of the same shapes,
+#               or "sharded" for a dataset streamed from the shards in shard_dir,
+#         or DataLoader, an already constructed dataloader, whose lazy and sparse settings are used
+#  @nn_type: str, "fully_con" or "conv"
+#  @epochs, @neurons, @batch_size: int, number of epochs, neurons and images per batch
+#  @eager: bool, runs the training step eagerly for debugging instead of compiling it into a graph
+#  @jit_compile: bool, additionally compiles the graph with XLA
+#  @pipeline, @cache, @deterministic, @drop_remainder, @shuffle, @buffer_size: passed to DataLoader.loader(),
+#                                                                             pipeline is "basic" or "tuned",
+#                                                                             shuffle None is "buffer" for the sharded
+#                                                                             dataset and "index" for all others
+#  @lazy: bool, keeps the images as uint8 and scales them per batch
+#  @cache_dir: str or None, directory in which the preprocessed dataset is cached
+#  @sparse: bool, keeps labels as int32 class indices instead of one-hot encoding them
+#  @eval_batch_size: int, number of images per batch when evaluating on the test subset
+#  @streaming_auc: bool, estimates the AUC from histograms so that evaluation memory stays constant
+#  @replicas: int, number of CPU replicas for data-parallel training with MirroredStrategy, 1 trains on a single device
+#  @synthetic_n: int, number of training images of the synthetic datasets
+#  @shard_dir: str, directory with shards written by DataLoader.to_shards(), used by the "sharded" dataset
+#  @augment: bool, augments training batches with random crops, flips and brightness changes (images of CIFAR10 shape only)
+#  @seed: int or None, seed of the shuffling and the augmentation
+#  @checkpoint_dir: str or None, directory for checkpoints of the model, the optimizer, the position in training
+#                   and the seed, None disables checkpointing, checkpointing forces a deterministic pipeline 
+#                   and creates the loader for every epoch, which with "full" shuffling copies the arrays every epoch
+#  @checkpoint_every: int or None, number of steps between checkpoints, None checkpoints at the end of every epoch only
+#  @resume: bool, resumes from the latest checkpoint in checkpoint_dir, also in the middle of an epoch
+#  @export: str or None, path the trained model is exported to for predict.py, None exports nothing
+#  @export_format: str, "saved_model" or "tflite"
+#  @precision: str, keras dtype policy, "float32", "mixed_bfloat16" or "mixed_float16" (with loss scaling),
+#              mixed policies compute hidden layers in 16 bits and keep float32 weights, softmax and loss
+#  @validation: float, share of the training subset split off for validation, the validation AUC is computed 
+#               after every epoch, 0 disables validation, a dataloader that already has a validation subset keeps it
+#  @patience: int or None, stops training once the validation AUC has not improved for patience epochs and restores 
+#             the weights of the best epoch, None always trains for all epochs, requires a validation subset
+#  @profile_dir: str or None, directory for per-phase timings, TensorBoard traces and scalar summaries 
+#                of loss, throughput and input-wait fraction, None disables profiling
+#  @trace_steps: tuple (start, stop) or None, global steps [start, stop) recorded with tf.profiler, requires profile_dir
+#  @summary_every: int, number of steps between scalar summaries
+#  @fused: bool, applies all layers of the model as a single model emitting logits with a fused softmax cross-entropy loss
+#  @logits: bool, the classification layer emits logits, the loss is computed on them and the softmax is only applied 
+#           for predictions, implied by fused
+#  @spec: str or None, layer spec of the hidden layers, e.g. "conv:32:3:1:relu,pool:2,res:64,gap", 
+#        which replaces the default hidden layers of nn_type, neurons is then ignored, see models.parse_spec()
+#  @separable: bool, uses depthwise-separable convolutions and global average pooling in the convolutional network
+#  @steps_per_call: int, number of training steps run in one call of the compiled loop, 
+#                   so that python and the host only see every steps_per_call-th step
+#  @log_every: int or None, number of steps between printouts of the running loss, None prints it once per epoch
+#  @quantize: str or None, "dynamic" or "int8", compares the quantized TFLite model with the float32 one on the test subset
+#             and exports the quantized model, which requires export_format "tflite", see quantize.py
+#  @verbose: bool, prints the loss (and validation AUC) after every epoch and the final AUC
+#  @return dict with the AUC, the training time in seconds, the number of training steps and steps per second,
+#          the number of epochs trained, the best validation AUC (None without validation)
+#          the seconds spent in every phase (None without profiling), the parameters and FLOPs per sample
+#          and the comparison of the quantized model (None without quantization)
 #
-def train(dset, nn_type, epochs = 10, neurons = 50, batch_size = 256):
+def train(dset, nn_type, epochs = 10, neurons = 50, batch_size = 256, eager = False, jit_compile = False,
+          pipeline = "tuned", cache = False, deterministic = True, drop_remainder = False, shuffle = None, buffer_size = None,
+          lazy = False, cache_dir = None, sparse = False, eval_batch_size = 1024, streaming_auc = False, replicas = 1,
+          precision = "float32", synthetic_n = 60000, shard_dir = None,
+          augment = False, seed = None, checkpoint_dir = None, checkpoint_every = None, resume = False,
+          export = None, export_format = "saved_model", validation = 0.0, patience = None,
+          profile_dir = None, trace_steps = None, summary_every = 100,
+          fused = False, logits = False, spec = None, separable = False,
+          steps_per_call = 1, log_every = None, quantize = None, verbose = True):
 
     # ensure that epochs and neurons are as expected
     assert epochs > 0, "epochs should be an integer greater than zero"
+    assert trace_steps is None or profile_dir is not None, "traces require a profile_dir"
+    assert quantize is None or export is None or export_format == "tflite", "quantized models can only be exported as tflite"
     assert neurons > 0, "neurons should be an integer greater than zero"
+    assert replicas > 0, "replicas should be an integer greater than zero"
 
+    # the replicated step only exists as a compiled graph
+    if replicas > 1 and eager:
+        raise ValueError("data-parallel training with more than one replica requires the compiled training step")
 
+    # the logical devices have to be configured before tensorflow initializes them,
+    # the default strategy places everything on a single device
+    strategy = cpu_strategy(replicas) if replicas > 1 else tf.distribute.get_strategy()
 
-    # defines optimizer with an appropriate learning rate
-    optimizer = tf.keras.optimizers.Adam(learning_rate = 5e-4)
+
+    # uses a dataloader that was constructed by the caller, e.g. one shared between runs of a sweep
+    if isinstance(dset, DataLoader):
+        data_loader = dset
+        sparse = data_loader.sparse
 
     # use MNIST dataloader class if a user specified "mnist"
-    if dset == "mnist":      
-        data_loader = MNIST()
+    elif dset == "mnist":      
+        data_loader = MNIST(lazy = lazy, cache_dir = cache_dir, sparse = sparse)
 
     # use CIFAR10 dataloader class if a user specified "cifar10"
     elif dset == "cifar10":
-        data_loader = CIFAR10()
+        data_loader = CIFAR10(lazy = lazy, cache_dir = cache_dir, sparse = sparse)
+
+    # generated images need no download and scale to any number of images
+    elif dset == "synthetic_mnist":
+        data_loader = Synthetic(n_tr = synthetic_n, shape = (28 * 28,), lazy = lazy, sparse = sparse)
+
+    elif dset == "synthetic_cifar10":
+        data_loader = Synthetic(n_tr = synthetic_n, shape = (32, 32, 3), lazy = lazy, sparse = sparse)
+
+    # streams a dataset that does not fit in memory from disk, 
+    # lazy and sparse are the ones the shards were written with
+    elif dset == "sharded":
+        data_loader = Sharded(shard_dir)
+        sparse = data_loader.sparse
+
+    # the validation images are taken from the end of the training subset, the test subset stays untouched
+    if validation > 0 and data_loader.n_va == 0:
+        data_loader.split_validation(validation)
+    assert patience is None or data_loader.n_va > 0, "early stopping requires a validation subset"
 
     # ensure that batch_size is within expected range
-    if (batch_size < 1) or (batch_size > data_loader.x_tr.shape[0]):
+    if (batch_size < 1) or (batch_size > data_loader.n_tr):
         raise ValueError("batch_size should be an integer between 1 and the number of images in the training subset")
     
-    # create tf data loader object with specified batch_size
-    tr_data = data_loader.loader(batch_size = batch_size)
+    # sharded datasets are streamed, all others shuffle indices to avoid a second copy of the images
+    if shuffle is None:
+        shuffle = "buffer" if isinstance(data_loader, Sharded) else "index"
+
+    # a checkpointed run has to reproduce the order of the interrupted epoch, so it needs a seed
+    # and batches in order, also from the interleaved shards of the sharded dataset
+    if checkpoint_dir is not None:
+        deterministic = True
+        if seed is None:
+            seed = random.randrange(2 ** 31)
+
+
+    ## Creates the tf data loader object with specified batch_size for an epoch, skipping the first skip batches
+    #  Without checkpoints the loader is created once and reshuffles every epoch, with checkpoints it is created
+    #  for every epoch with a seed derived from the epoch, so that the order of every epoch can be reproduced,
+    #  with "full" shuffling this copies the arrays into a new dataset every epoch, "index" shuffling copies nothing
+    #
+    def epoch_data(epoch, skip):
+        tr_data = data_loader.loader(batch_size = batch_size, tuned = (pipeline == "tuned"), cache = cache,
+                                     deterministic = deterministic, drop_remainder = drop_remainder, 
+                                     shuffle = shuffle, buffer_size = buffer_size, augment = augment, 
+                                     seed = None if seed is None else seed + epoch, skip = skip)
+
+        # every replica receives its share of each batch
+        if replicas > 1:
+            tr_data = strategy.experimental_distribute_dataset(tr_data)
+
+        return tr_data
     
 
-    # use FullyConNN model if a user specified "fully_con"
-    if nn_type == "fully_con":
-        # the number of neurons passed are the ones that a user specified
-        # the number of classes should be 10 independent of user choices
-        model = FullyConNN(neurons = neurons, y_dim = 10)
+    # layers take their compute dtype from the global policy when they are created,
+    # it is always set so that an earlier call of train() does not leak its policy
+    tf.keras.mixed_precision.set_global_policy(precision)
+
+    # model variables and optimizer slots are mirrored on every replica if they are created in the strategy's scope
+    with strategy.scope():
+
+        # defines optimizer with an appropriate learning rate
+        optimizer = tf.keras.optimizers.Adam(learning_rate = 5e-4)
+
+        # float16 needs loss scaling to keep small gradients from underflowing
+        if precision == "mixed_float16":
+            optimizer = tf.keras.mixed_precision.LossScaleOptimizer(optimizer)
+
+        # use FullyConNN model if a user specified "fully_con"
+        if nn_type == "fully_con":
+            # the number of neurons passed are the ones that a user specified
+            # the number of classes should be 10 independent of user choices
+            model = FullyConNN(neurons = neurons, y_dim = 10, sparse = sparse, fused = fused, logits = logits, spec = spec)
+
+        # use ConvNN model if a user specified "conv"
+        elif nn_type == "conv":
+            # the number of neurons passed are the ones that a user specified
+            # the number of classes should be 10 independent of user choices
+            model = ConvNN(neurons = neurons, y_dim = 10, sparse = sparse, fused = fused, logits = logits, spec = spec,
+                           separable = separable)
+
+    # compute per sample of the forward pass, known before training starts
+    cost = model.cost()
+    if verbose:
+        print(f"{cost['params']} parameters, {cost['flops'] / 1e6:.2f} MFLOPs per sample in the forward pass")
+
+    # compiles the training step, so that python dispatch is paid once per trace instead of once per batch
+    # when the last incomplete batch is dropped the batch dimension is static as well
+    if replicas > 1:
+        model.compile_train(optimizer, jit_compile = jit_compile, strategy = strategy, steps_per_call = steps_per_call)
+    elif not eager:
+        model.compile_train(optimizer, jit_compile = jit_compile, batch_size = batch_size if drop_remainder else None,
+                            steps_per_call = steps_per_call)
+
 
-    # use ConvNN model if a user specified "conv"
-    elif nn_type == "conv":
-        # the number of neurons passed are the ones that a user specified
-        # the number of classes should be 10 independent of user choices
-        model = ConvNN(neurons = neurons, y_dim = 10)
+    # the position in training, the number of steps taken and the seed are checkpointed with the model
+    # and the optimizer, together they determine the batches the training continues with
+    epoch, step, global_step = 0, 0, 0
+    manager = None
+    if checkpoint_dir is not None:
+        state = {"epoch": tf.Variable(0, dtype = tf.int64), "step": tf.Variable(0, dtype = tf.int64), 
+                 "global_step": tf.Variable(0, dtype = tf.int64), "seed": tf.Variable(seed, dtype = tf.int64)}
+        checkpoint = tf.train.Checkpoint(model = model, optimizer = optimizer, **state)
+        manager = tf.train.CheckpointManager(checkpoint, checkpoint_dir, max_to_keep = 3)
 
+        # checkpoints are written in a background thread, the training step only waits for the variables to be copied
+        options = tf.train.CheckpointOptions(experimental_enable_async_checkpoint = True)
+
+        if resume and manager.latest_checkpoint is not None:
+            checkpoint.restore(manager.latest_checkpoint)
+            epoch, step, global_step, seed = (int(state[key].numpy()) for key in ("epoch", "step", "global_step", "seed"))
+            if verbose:
+                print(f"Resumed from {manager.latest_checkpoint} at epoch {epoch}, step {step}")
+
+
+    ## Whether the last n steps crossed a multiple of every
+    #
+    def crossed(every, n):
+        return global_step // every > (global_step - n) // every
+
+
+    ## Writes a checkpoint of the current position in training
+    #
+    def save():
+        for key, value in (("epoch", epoch), ("step", step), ("global_step", global_step), ("seed", seed)):
+            state[key].assign(value)
+        manager.save(checkpoint_number = global_step, options = options)
+
+
+    # early stopping keeps the weights of the epoch with the best validation AUC,
+    # its state is not checkpointed, so a resumed run starts counting patience anew
+    best_auc, best_epoch, best_weights = None, epoch, None
+    stop = False
+
+    # the disabled profiler does nothing, eagerly run steps additionally report their phases
+    profiler = NullProfiler() if profile_dir is None else Profiler(profile_dir, trace_steps = trace_steps, summary_every = summary_every)
+    if eager and profile_dir is not None:
+        model.set_profiler(profiler)
 
     # training routine
-    step = 0 # counter for current epoch
-    while step < epochs: # iterate epochs number of times
+    tr_data = None
+    start_step, start_time = global_step, time.perf_counter()
+    while epoch < epochs: # iterate epochs number of times
+
+        # with checkpoints the loader is recreated for every epoch, see epoch_data()
+        if tr_data is None or manager is not None:
+            tr_data = epoch_data(epoch, skip = step)
         
-        # load data in batches
-        for i, data_batch in enumerate(tr_data): 
-            
-            # train model on each batch 
-            losses = model.train(data_batch, optimizer)
+        # the loss is accumulated on the device, it is only read when it is logged
+        model.reset_running_loss()
+        epoch_start = step
+
+        # load data in batches, the time spent waiting for a batch is the input phase,
+        # with steps_per_call > 1 batches are read inside of the compiled loop and belong to the step phase
+        iterator = iter(tr_data)
+        while True:
+            profiler.begin(global_step)
+            if steps_per_call > 1:
+                with profiler.phase("step"):
+                    n = int(model.train_loop(iterator, optimizer))
+                if n == 0:
+                    break
+            else:
+                with profiler.phase("input"):
+                    data_batch = next(iterator, None)
+                if data_batch is None:
+                    break
+
+                # train model on each batch 
+                with profiler.phase("step"):
+                    profiler.wait(model.train(data_batch, optimizer))
+                n = 1
+
+            profiler.end(batch_size, steps = n, loss = model.running_loss)
+            step += n
+            global_step += n
+
+            if manager is not None and checkpoint_every is not None and crossed(checkpoint_every, n):
+                save()
+
+            if verbose and log_every is not None and crossed(log_every, n):
+                mean, last = model.running_loss()
+                print(f"Step: {global_step}, mean loss: {float(mean):.4f}, last batch's loss: {float(last):.4f}")
         
-        # print out the current epoch and loss of the last batch
-        print(f"Epoch: {step}, last batch's loss: {losses.numpy().mean():.4f}") 
+        # print out the current epoch and loss of the last batch,
+        # a run resumed at the very end of an epoch has no batches left in it
+        if verbose and step > epoch_start:
+            mean, last = model.running_loss()
+            print(f"Epoch: {epoch}, mean loss: {float(mean):.4f}, last batch's loss: {float(last):.4f}") 
+
+        # a cheap pass over the validation subset with the batched test()
+        if data_loader.n_va > 0:
+            val_auc = evaluate(model, data_loader, batch_size = eval_batch_size, streaming = streaming_auc, subset = "va")
+            if verbose:
+                print(f"Epoch: {epoch}, validation auc: {val_auc:.4f}")
+
+            if best_auc is None or val_auc > best_auc:
+                best_auc, best_epoch = val_auc, epoch
+                if patience is not None:
+                    best_weights = model.get_weights()
+            elif patience is not None and epoch - best_epoch >= patience:
+                stop = True
         
         # move to the next epoch
-        step += 1
+        epoch += 1
+        step = 0
+        if manager is not None:
+            save()
+
+        if stop:
+            if verbose:
+                print(f"Stopping early, the validation auc has not improved since epoch {best_epoch}")
+            break
+
+    # waits for the last asynchronous checkpoint to be written
+    if manager is not None:
+        checkpoint.sync()
+
+    seconds = time.perf_counter() - start_time
+    steps = global_step - start_step
+    profile = profiler.close()
+    if verbose and profile is not None:
+        print("profile: " + ", ".join(f"{key} {value:.3f}" for key, value in profile.items()))
 
-    # calculate (pseudo)probabilities for test subset
-    pi_hat = model.test(data_loader.x_te)
+    # the test subset is evaluated with the weights of the best epoch
+    if best_weights is not None:
+        model.set_weights(best_weights)
 
-    # estimate auc score and print it out        
-    auc = roc_auc_score(data_loader.y_te, pi_hat)
-    print("final auc %0.4f" % (auc))
+    # calculate (pseudo)probabilities for test subset in batches
+    # and estimate auc score and print it out
+    auc = evaluate(model, data_loader, batch_size = eval_batch_size, streaming = streaming_auc)
+    if verbose:
+        print("final auc %0.4f" % (auc))
+
+    # the quantized model is scored on the same test subset as the float32 TFLite model
+    quantized = None
+    if quantize is not None:
+        quantized, contents = ptq.compare(model, data_loader, modes = (quantize,), batch_size = eval_batch_size)
+        if verbose:
+            print("%s auc %0.4f (delta %+0.4f), %0.2fx faster than float32 tflite, %d bytes" 
+                  % (quantize, quantized[quantize]["auc"], quantized[quantize]["auc_delta"], 
+                     quantized[quantize]["speedup"], quantized[quantize]["bytes"]))
+
+    # exports test() so that predictions do not need the training code,
+    # the quantized model is the one that was compared, it is not converted a second time
+    if export is not None and quantize is not None:
+        with open(export, "wb") as f:
+            f.write(contents[quantize])
+    elif export is not None:
+        model.export_artifact(export, format = export_format)
+
+    return {"auc": float(auc), "seconds": seconds, "steps": steps, "steps_per_sec": steps / seconds if seconds > 0 else 0.0,
+            "epochs_trained": epoch, "val_auc": None if best_auc is None else float(best_auc), "profile": profile,
+            "params": cost["params"], "flops": cost["flops"], "quantized": quantized}
 
 
 
@@ -102,7 +418,7 @@ if __name__ == "__main__":
 
     # add the expected arguments to out parser
     # only MNIST and CIFAR10 can be used, that's why we use choices here
-    parser.add_argument("--dset", choices = ["mnist", "cifar10"], help = "Dataset for model training and testing")
+    parser.add_argument("--dset", choices = ["mnist", "cifar10", "synthetic_mnist", "synthetic_cifar10", "sharded"], help = "Dataset for model training and testing")
     
     # only fully_con and conv models can be used, that's why we use choices here
     parser.add_argument("--nn_type", choices = ["fully_con", "conv"], help = "Neural network architecture")
@@ -116,8 +432,106 @@ if __name__ == "__main__":
     # batch_size should be an integer
     parser.add_argument("--batch_size", default = 256, type = int, help = "Number of images to be processed during one iteration of model training")
     
+    # the compiled training step is used unless eager mode is requested
+    parser.add_argument("--eager", action = "store_true", help = "Run the training step eagerly, useful for debugging")
+
+    # XLA only makes sense for the compiled training step
+    parser.add_argument("--jit_compile", action = "store_true", help = "Compile the training step with XLA")
+    
+    # the tuned pipeline batches in parallel and prefetches, the basic one is kept for comparison
+    parser.add_argument("--pipeline", choices = ["basic", "tuned"], default = "tuned", help = "Input pipeline used for training")
+
+    # the remaining pipeline knobs only affect the tuned pipeline, except for drop_remainder
+    parser.add_argument("--cache", action = "store_true", help = "Cache the training dataset after the first epoch")
+    parser.add_argument("--nondeterministic", action = "store_true", help = "Allow the input pipeline to produce batches out of order")
+    parser.add_argument("--drop_remainder", action = "store_true", help = "Drop the last incomplete batch so that batch shapes stay static")
+    
+    # "index" shuffling avoids keeping a second copy of the training images in memory
+    parser.add_argument("--shuffle", choices = ["full", "index", "buffer"], default = None, help = "Shuffling strategy of the input pipeline, by default buffer for --dset sharded and index otherwise")
+    parser.add_argument("--buffer_size", default = None, type = int, help = "Size of the shuffle buffer for --shuffle buffer, by default 16 batches")
+    
+    # keeps images as uint8 and scales them per batch instead of converting the whole dataset to float32
+    parser.add_argument("--lazy", action = "store_true", help = "Scale images per batch instead of up front")
+    
+    # the preprocessed dataset is cached on disk, so repeated runs reopen it instead of preprocessing it again
+    parser.add_argument("--cache_dir", default = None, help = "Directory for the cache of preprocessed datasets")
+    
+    # integer labels need 10 times less memory than one-hot encoded ones for 10 classes
+    parser.add_argument("--sparse", action = "store_true", help = "Keep labels as class indices instead of one-hot encoding them")
+    
+    # evaluation runs over batches of the test subset
+    parser.add_argument("--eval_batch_size", default = 1024, type = int, help = "Number of images per batch during evaluation")
+    parser.add_argument("--streaming_auc", action = "store_true", help = "Estimate the AUC from histograms instead of keeping all predictions")
+    
+    # the number of CPU replicas for data-parallel training, each replica processes batch_size / replicas images
+    parser.add_argument("--replicas", default = 1, type = int, help = "Number of CPU replicas for data-parallel training")
+    
+    # mixed precision computes the hidden layers in 16 bits, bfloat16 is supported by the matmul units of recent CPUs
+    parser.add_argument("--precision", choices = ["float32", "mixed_bfloat16", "mixed_float16"], default = "float32", help = "Keras dtype policy used for training")
+    
+    # the size of the synthetic datasets can be much larger than the size of MNIST or CIFAR10
+    parser.add_argument("--synthetic_n", default = 60000, type = int, help = "Number of training images of the synthetic datasets")
+    
+    # shards can be written with e.g. MNIST(lazy = True).to_shards(directory)
+    parser.add_argument("--shard_dir", default = None, help = "Directory with the shards of the sharded dataset")
+    
+    # augmentation operates on whole batches of images and is reproducible given a seed
+    parser.add_argument("--augment", action = "store_true", help = "Augment training batches with random crops, flips and brightness changes")
+    parser.add_argument("--seed", default = None, type = int, help = "Seed of the shuffling and the augmentation, stored in checkpoints for resuming")
+    
+    # checkpoints are written asynchronously, --resume continues from the latest one, also in the middle of an epoch
+    parser.add_argument("--checkpoint_dir", default = None, help = "Directory for checkpoints, by default no checkpoints are written")
+    parser.add_argument("--checkpoint_every", default = None, type = int, help = "Number of steps between checkpoints, by default one per epoch")
+    parser.add_argument("--resume", action = "store_true", help = "Resume from the latest checkpoint in --checkpoint_dir")
+    
+    # the exported model can be used with predict.py
+    parser.add_argument("--export", default = None, help = "Path the trained model is exported to")
+    parser.add_argument("--export_format", choices = ["saved_model", "tflite"], default = "saved_model", help = "Format of the exported model")
+    
+    # the validation subset is taken from the training subset, early stopping restores the weights of the best epoch
+    parser.add_argument("--validation", default = 0.0, type = float, help = "Share of the training images used for validation after every epoch")
+    parser.add_argument("--patience", default = None, type = int, help = "Stop after this many epochs without improvement of the validation AUC")
+    
+    # profiling times the input and the training step separately, view the traces and summaries with tensorboard --logdir
+    parser.add_argument("--profile_dir", default = None, help = "Directory for TensorBoard traces and summaries, by default no profiling")
+    parser.add_argument("--trace_steps", nargs = 2, default = None, type = int, metavar = ("START", "STOP"), help = "Global steps recorded with tf.profiler, requires --profile_dir")
+    parser.add_argument("--summary_every", default = 100, type = int, help = "Number of steps between scalar summaries")
+    
+    # a single model from the features to the logits, the softmax is fused into the loss
+    parser.add_argument("--fused", action = "store_true", help = "Apply all layers as a single model with a loss on the logits")
+    
+    # the softmax of the classification layer is left out of training, the AUC is computed from the same probabilities
+    parser.add_argument("--logits", action = "store_true", help = "Compute the loss on logits and apply the softmax only for predictions")
+    
+    # deeper architectures are described layer by layer, e.g. --spec conv:32:3:1:relu,bn,pool:2,res:64,pool:2,res:128,gap
+    parser.add_argument("--spec", default = None, help = "Layer spec of the hidden layers, replaces the default ones of --nn_type")
+    
+    # the separable layout needs about 2.8x fewer FLOPs than the default convolutional network
+    parser.add_argument("--separable", action = "store_true", help = "Use depthwise-separable convolutions and pooling for --nn_type conv")
+    
+    # the loss stays on the device between printouts, several steps per call also avoid the python overhead of every step
+    parser.add_argument("--steps_per_call", default = 1, type = int, help = "Number of training steps run in one call of the compiled loop")
+    parser.add_argument("--log_every", default = None, type = int, help = "Number of steps between printouts of the running loss, by default once per epoch")
+
+    # int8 models are compared with the float32 TFLite model and exported instead of it
+    parser.add_argument("--quantize", choices = ["dynamic", "int8"], default = None, 
+                        help = "Quantize the trained model after training and compare its AUC and speed, exported with --export_format tflite")
+    
     # parse the arguments so that we can pass them to train() function
     args = parser.parse_args()
     
     # call train() function using the provided inputs
-    train(dset = args.dset, nn_type = args.nn_type, epochs = args.epochs, neurons = args.neurons, batch_size = args.batch_size)
+    train(dset = args.dset, nn_type = args.nn_type, epochs = args.epochs, neurons = args.neurons, batch_size = args.batch_size,
+          eager = args.eager, jit_compile = args.jit_compile, pipeline = args.pipeline, cache = args.cache, 
+          deterministic = not args.nondeterministic, drop_remainder = args.drop_remainder, 
+          shuffle = args.shuffle, buffer_size = args.buffer_size, lazy = args.lazy, 
+          cache_dir = args.cache_dir, sparse = args.sparse, 
+          eval_batch_size = args.eval_batch_size, streaming_auc = args.streaming_auc,
+          replicas = args.replicas, precision = args.precision,
+          synthetic_n = args.synthetic_n, shard_dir = args.shard_dir,
+          augment = args.augment, seed = args.seed, checkpoint_dir = args.checkpoint_dir, 
+          checkpoint_every = args.checkpoint_every, resume = args.resume, export = args.export, 
+          export_format = args.export_format, validation = args.validation, patience = args.patience,
+          profile_dir = args.profile_dir, trace_steps = args.trace_steps, summary_every = args.summary_every,
+          fused = args.fused, logits = args.logits, spec = args.spec, separable = args.separable,
+          steps_per_call = args.steps_per_call, log_every = args.log_every, quantize = args.quantize)